@@ -1,126 +1,450 @@
+import sys
+from datetime import datetime
+
+import numpy as np
 import pandas as pd
 from scipy import stats
-
-from database import get_session, get_all_players, get_player_matches
-from models import MatchHistory
-from config import ANOMALY_THRESHOLD
+from sqlalchemy import case, func, or_, select, update
+
+from database import get_session, rebuild_metric_moments
+from models import Player, MatchHistory, ChampionStats, MetricMoments
+from metrics import METRICS
+from config import (
+    ANOMALY_THRESHOLD,
+    ANOMALY_DETECTOR,
+    ANOMALY_WINDOW,
+    REMAKE_MAX_DURATION,
+)
+
+
+SUMMARY_AVERAGES = [
+    ("avg_kills", MatchHistory.kills, 1),
+    ("avg_deaths", MatchHistory.deaths, 1),
+    ("avg_assists", MatchHistory.assists, 1),
+    ("avg_kda", MatchHistory.kda, 2),
+    ("avg_gpm", MatchHistory.gold_per_min, 0),
+    ("avg_cspm", MatchHistory.cs_per_min, 1),
+    ("avg_dpm", MatchHistory.damage_per_min, 0),
+    ("avg_vision", MatchHistory.vision_score, 0),
+]
 
 
 def calculate_player_summary(session):
-    players = get_all_players(session)
-    summaries = []
-
-    for player in players:
-        matches = get_player_matches(session, player.id)
-
-        if not matches:
-            continue
-
-        total = len(matches)
-        wins = sum(1 for m in matches if m.win)
-        losses = total - wins
-
-        summaries.append(
-            {
-                "name": player.name,
-                "tag_line": player.tag_line,
-                "level": player.level,
-                "profile_icon_url": player.profile_icon_url,
-                "total_games": total,
-                "wins": wins,
-                "losses": losses,
-                "win_rate": round(wins / total * 100, 1) if total > 0 else 0,
-                "avg_kills": round(sum(m.kills for m in matches) / total, 1),
-                "avg_deaths": round(sum(m.deaths for m in matches) / total, 1),
-                "avg_assists": round(sum(m.assists for m in matches) / total, 1),
-                "avg_kda": round(sum(m.kda for m in matches) / total, 2),
-                "avg_gpm": round(sum(m.gold_per_min for m in matches) / total, 0),
-                "avg_cspm": round(sum(m.cs_per_min for m in matches) / total, 1),
-                "avg_dpm": round(sum(m.damage_per_min for m in matches) / total, 0),
-                "avg_vision": round(sum(m.vision_score for m in matches) / total, 0),
-            }
+    stmt = (
+        select(
+            Player.name,
+            Player.tag_line,
+            Player.level,
+            Player.profile_icon_url,
+            func.count(MatchHistory.id).label("total_games"),
+            func.sum(case((MatchHistory.win == True, 1), else_=0)).label("wins"),
+            *[func.avg(column).label(label) for label, column, _ in SUMMARY_AVERAGES],
+        )
+        .join(MatchHistory, MatchHistory.player_id == Player.id)
+        .group_by(Player.id)
+        .order_by(Player.id)
+    )
+    df = pd.read_sql(stmt, session.connection())
+    return finish_summary(df)
+
+
+def summarize_frame(frame):
+    if frame.empty:
+        return pd.DataFrame()
+
+    aggregations = {
+        "tag_line": ("tag_line", "first"),
+        "level": ("level", "first"),
+        "profile_icon_url": ("profile_icon_url", "first"),
+        "total_games": ("match_id", "size"),
+        "wins": ("win", "sum"),
+    }
+    for label, column, _ in SUMMARY_AVERAGES:
+        aggregations[label] = (column.key, "mean")
+
+    df = frame.groupby(["player_id", "name"], sort=True).agg(**aggregations)
+    df["wins"] = df["wins"].astype(int)
+    return finish_summary(df.reset_index())
+
+
+def finish_summary(df):
+    if df.empty:
+        return pd.DataFrame()
+
+    df["losses"] = df["total_games"] - df["wins"]
+    df["win_rate"] = (df["wins"] / df["total_games"] * 100).round(1)
+    for label, _, digits in SUMMARY_AVERAGES:
+        df[label] = df[label].astype(float).round(digits)
+
+    return df[
+        [
+            "name",
+            "tag_line",
+            "level",
+            "profile_icon_url",
+            "total_games",
+            "wins",
+            "losses",
+            "win_rate",
+        ]
+        + [label for label, _, _ in SUMMARY_AVERAGES]
+    ]
+
+
+def calculate_champion_stats(session):
+    stmt = (
+        select(
+            Player.name,
+            Player.tag_line,
+            ChampionStats.champion_name,
+            ChampionStats.champion_icon_url,
+            ChampionStats.games,
+            ChampionStats.wins,
+            ChampionStats.kills,
+            ChampionStats.deaths,
+            ChampionStats.assists,
+            ChampionStats.game_duration,
+            ChampionStats.gold_earned,
+            ChampionStats.cs,
+            ChampionStats.total_damage,
+            ChampionStats.vision_score,
+        )
+        .join(ChampionStats, ChampionStats.player_id == Player.id)
+        .where(ChampionStats.games > 0)
+        .order_by(Player.id, ChampionStats.games.desc(), ChampionStats.champion_name)
+    )
+    df = pd.read_sql(stmt, session.connection())
+    if df.empty:
+        return pd.DataFrame()
+
+    minutes = (df["game_duration"] / 60).clip(lower=1)
+    df["losses"] = df["games"] - df["wins"]
+    df["win_rate"] = (df["wins"] / df["games"] * 100).round(1)
+    df["avg_kills"] = (df["kills"] / df["games"]).round(1)
+    df["avg_deaths"] = (df["deaths"] / df["games"]).round(1)
+    df["avg_assists"] = (df["assists"] / df["games"]).round(1)
+    df["kda"] = ((df["kills"] + df["assists"]) / df["deaths"].clip(lower=1)).round(2)
+    df["avg_gpm"] = (df["gold_earned"] / minutes).round(0)
+    df["avg_cspm"] = (df["cs"] / minutes).round(1)
+    df["avg_dpm"] = (df["total_damage"] / minutes).round(0)
+    df["avg_vision"] = (df["vision_score"] / df["games"]).round(0)
+    df["pool_share"] = (
+        df["games"] / df.groupby("name")["games"].transform("sum") * 100
+    ).round(1)
+    return df
+
+
+ANOMALY_METRICS = [
+    {
+        "column": "kda",
+        "high": "Very high KDA ({})",
+        "low": "Very low KDA ({})",
+        "format": "float",
+    },
+    {
+        "column": "deaths",
+        "high": "Many deaths ({})",
+        "low": None,
+        "format": "int",
+    },
+    {
+        "column": "damage_per_min",
+        "high": "Very high damage ({} DPM)",
+        "low": "Very low damage ({} DPM)",
+        "format": "int",
+    },
+    {
+        "column": "gold_per_min",
+        "high": "Very high gold ({} GPM)",
+        "low": "Very low gold ({} GPM)",
+        "format": "int",
+    },
+    {
+        "column": "game_duration",
+        "high": "Very long game ({} min)",
+        "low": "Very short game ({} min)",
+        "format": "minutes",
+    },
+]
+
+
+MIN_BASELINE_GAMES = 5
+MAD_SCALE = 1.4826
+MEAN_AD_SCALE = 1.2533
+
+
+def anomaly_columns():
+    return [metric["column"] for metric in ANOMALY_METRICS]
+
+
+def load_match_frame(session, columns, *conditions):
+    stmt = select(
+        MatchHistory.id,
+        MatchHistory.player_id,
+        *[MatchHistory.__table__.c[column] for column in columns],
+    ).where(*conditions)
+    return pd.read_sql(stmt, session.connection())
+
+
+def load_history(session):
+    history = load_match_frame(
+        session, anomaly_columns() + ["game_date", "champion_name"]
+    )
+    history["is_remake"] = history["game_duration"] < REMAKE_MAX_DURATION
+    return history
+
+
+def load_moments(session):
+    df = pd.read_sql(select(MetricMoments), session.connection())
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df["std"] = np.sqrt(df["m2"] / (df["count"] - 1)).where(df["count"] > 1)
+    return df.pivot(index="player_id", columns="metric")
+
+
+def format_metric(values, fmt):
+    if fmt == "int":
+        return values.astype(int).astype(str)
+    if fmt == "minutes":
+        return (values // 60).astype(int).astype(str)
+    return values.astype(str)
+
+
+def baseline_arrays(keys, count, center, scale):
+    baselines = {}
+    for column in anomaly_columns():
+        baselines[column] = tuple(
+            (
+                frame[column].reindex(keys).to_numpy(dtype=float)
+                if column in frame.columns
+                else np.full(len(keys), np.nan)
+            )
+            for frame in (count, center, scale)
+        )
+    return baselines
+
+
+def moments_baselines(session, df):
+    moments = load_moments(session)
+    if moments.empty:
+        empty = pd.DataFrame()
+        return baseline_arrays(df["player_id"], empty, empty, empty)
+    return baseline_arrays(
+        df["player_id"], moments["count"], moments["mean"], moments["std"]
+    )
+
+
+def rolling_baselines(session, df, window=ANOMALY_WINDOW):
+    history = load_history(session).sort_values(
+        ["player_id", "game_date", "id"], kind="stable", ignore_index=True
+    )
+    kept = (~history["is_remake"]).to_numpy()
+    baseline = history[kept]
+    players = history["player_id"].to_numpy()
+
+    # Games of the same player in the window before each match, as
+    # [start, end) offsets into the remake-free baseline rows
+    before = pd.Series(kept.astype(int)).groupby(players).cumsum().to_numpy() - kept
+    first = np.searchsorted(baseline["player_id"].to_numpy(), players)
+    end = first + before
+    start = np.maximum(end - window, first)
+
+    count, center, scale = {}, {}, {}
+    for column in anomaly_columns():
+        # Center on the player's mean so the prefix sums stay small
+        means = baseline.groupby("player_id")[column].mean().fillna(0)
+        offset = means.reindex(players).fillna(0).to_numpy()
+        values = baseline[column].to_numpy(dtype=float)
+        present = ~np.isnan(values)
+        shifted = np.where(
+            present, values - means.reindex(baseline["player_id"]).to_numpy(), 0.0
         )
 
-    return pd.DataFrame(summaries)
-
-
-def detect_anomalies(session):
-    players = get_all_players(session)
+        n = np.concatenate([[0], np.cumsum(present)])
+        s1 = np.concatenate([[0.0], np.cumsum(shifted)])
+        s2 = np.concatenate([[0.0], np.cumsum(shifted * shifted)])
+
+        games = (n[end] - n[start]).astype(float)
+        total = s1[end] - s1[start]
+        squares = s2[end] - s2[start]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = total / games
+            variance = np.maximum(squares - total * mean, 0) / (games - 1)
+        count[column] = games
+        center[column] = mean + offset
+        scale[column] = np.where(games > 1, np.sqrt(variance), np.nan)
+
+    rows = pd.Index(history["id"]).get_indexer(df["id"])
+    return {
+        column: (count[column][rows], center[column][rows], scale[column][rows])
+        for column in anomaly_columns()
+    }
+
+
+def robust_baselines(session, df):
+    columns = anomaly_columns()
+    history = load_history(session)
+    baseline = history[~history["is_remake"]]
+    grouped = baseline.groupby("player_id")[columns]
+    median = grouped.median()
+
+    deviation = (
+        baseline[columns] - median.reindex(baseline["player_id"]).to_numpy()
+    ).abs()
+    by_player = deviation.groupby(baseline["player_id"])[columns]
+    mad = MAD_SCALE * by_player.median()
+    scale = mad.where(mad > 0, MEAN_AD_SCALE * by_player.mean())
+
+    return baseline_arrays(df["player_id"], grouped.count(), median, scale)
+
+
+def champion_baselines(session, df):
+    columns = anomaly_columns()
+    history = load_history(session)
+    baseline = history[~history["is_remake"]]
+    keys = ["player_id", "champion_name"]
+
+    by_player = baseline_arrays(
+        df["player_id"],
+        *[
+            getattr(baseline.groupby("player_id")[columns], name)()
+            for name in ("count", "mean", "std")
+        ],
+    )
+    by_champion = baseline_arrays(
+        pd.MultiIndex.from_frame(df[keys]),
+        *[
+            getattr(baseline.groupby(keys)[columns], name)()
+            for name in ("count", "mean", "std")
+        ],
+    )
+
+    baselines = {}
+    for column in columns:
+        use_champion = by_champion[column][0] >= MIN_BASELINE_GAMES
+        baselines[column] = tuple(
+            np.where(use_champion, champion, player)
+            for champion, player in zip(by_champion[column], by_player[column])
+        )
+    return baselines
+
+
+DETECTORS = {
+    "moments": moments_baselines,
+    "rolling": rolling_baselines,
+    "robust": robust_baselines,
+    "champion": champion_baselines,
+}
+
+
+def score_anomalies(df, baselines, threshold=ANOMALY_THRESHOLD):
+    reasons = np.full(len(df), "", dtype=object)
+    for metric in ANOMALY_METRICS:
+        column = metric["column"]
+        values = df[column].to_numpy(dtype=float)
+        count, center, scale = baselines[column]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = (values - center) / scale
+        valid = (count >= MIN_BASELINE_GAMES) & (scale > 0)
+
+        sides = [("high", valid & (z > threshold))]
+        if metric["low"]:
+            sides.append(("low", valid & (z < -threshold)))
+
+        for side, mask in sides:
+            if not mask.any():
+                continue
+            prefix, suffix = metric[side].split("{}")
+            text = format_metric(df[column][mask], metric["format"]).to_numpy(object)
+            separator = np.where(reasons[mask] == "", "", "; ").astype(object)
+            reasons[mask] = reasons[mask] + separator + prefix + text + suffix
+
+    is_anomaly = reasons != ""
+    return pd.DataFrame(
+        {
+            "id": df["id"].to_numpy(),
+            "is_anomaly": is_anomaly,
+            "anomaly_reason": np.where(is_anomaly, reasons, None),
+        }
+    )
+
+
+def save_anomaly_scores(
+    session, df, scores, threshold=ANOMALY_THRESHOLD, detector=ANOMALY_DETECTOR
+):
+    previous_reason = df["anomaly_reason"].fillna("").to_numpy(dtype=object)
+    reason = scores["anomaly_reason"].fillna("").to_numpy(dtype=object)
+    changed = (
+        df["is_anomaly"].fillna(False).astype(bool).to_numpy()
+        != scores["is_anomaly"].to_numpy()
+    ) | (previous_reason != reason)
+
+    updates = scores[changed]
+    if not updates.empty:
+        updated_at = datetime.now()
+        session.execute(
+            update(MatchHistory),
+            [
+                {
+                    "id": int(row.id),
+                    "is_anomaly": bool(row.is_anomaly),
+                    "anomaly_reason": row.anomaly_reason,
+                    "scored_threshold": threshold,
+                    "scored_detector": detector,
+                    "updated_at": updated_at,
+                }
+                for row in updates.itertuples(index=False)
+            ],
+        )
 
-    for player in players:
-        matches = get_player_matches(session, player.id)
+    unchanged = scores.loc[~changed, "id"]
+    if not unchanged.empty:
+        session.execute(
+            update(MatchHistory),
+            [
+                {
+                    "id": int(row_id),
+                    "scored_threshold": threshold,
+                    "scored_detector": detector,
+                }
+                for row_id in unchanged
+            ],
+        )
+    return len(updates)
+
+
+def detect_anomalies(
+    session, threshold=ANOMALY_THRESHOLD, detector=ANOMALY_DETECTOR, rescore=False
+):
+    if detector not in DETECTORS:
+        raise ValueError(f"Unknown anomaly detector: {detector}")
+
+    conditions = []
+    if rescore:
+        rebuild_metric_moments(session.connection())
+    else:
+        conditions.append(
+            or_(
+                MatchHistory.scored_threshold.is_(None),
+                MatchHistory.scored_threshold != threshold,
+                MatchHistory.scored_detector.is_(None),
+                MatchHistory.scored_detector != detector,
+            )
+        )
 
-        if len(matches) < 5:
-            continue
+    columns = anomaly_columns() + ["champion_name", "is_anomaly", "anomaly_reason"]
+    df = load_match_frame(session, columns, *conditions)
+    if df.empty:
+        return pd.DataFrame(columns=["id", "is_anomaly", "anomaly_reason"])
 
-        kdas = [m.kda for m in matches]
-        deaths_list = [m.deaths for m in matches]
-        dpms = [m.damage_per_min for m in matches]
-        gpms = [m.gold_per_min for m in matches]
-        durations = [m.game_duration for m in matches]
+    print(f"  Scoring {len(df)} matches with the {detector} detector")
+    scores = score_anomalies(df, DETECTORS[detector](session, df), threshold)
+    METRICS.count("matches_scored", len(df), detector=detector)
+    updated = save_anomaly_scores(session, df, scores, threshold, detector)
+    METRICS.rows("rows_written", updated, table="match_history")
 
-        kda_mean, kda_std = pd.Series(kdas).mean(), pd.Series(kdas).std()
-        deaths_mean, deaths_std = (
-            pd.Series(deaths_list).mean(),
-            pd.Series(deaths_list).std(),
-        )
-        dpm_mean, dpm_std = pd.Series(dpms).mean(), pd.Series(dpms).std()
-        gpm_mean, gpm_std = pd.Series(gpms).mean(), pd.Series(gpms).std()
-        dur_mean, dur_std = pd.Series(durations).mean(), pd.Series(durations).std()
-
-        for match in matches:
-            reasons = []
-
-            if kda_std > 0:
-                kda_z = abs(match.kda - kda_mean) / kda_std
-                if kda_z > ANOMALY_THRESHOLD:
-                    if match.kda > kda_mean:
-                        reasons.append(f"Very high KDA ({match.kda})")
-                    else:
-                        reasons.append(f"Very low KDA ({match.kda})")
-
-            if deaths_std > 0:
-                deaths_z = (match.deaths - deaths_mean) / deaths_std
-                if deaths_z > ANOMALY_THRESHOLD:
-                    reasons.append(f"Many deaths ({match.deaths})")
-
-            if dpm_std > 0:
-                dpm_z = abs(match.damage_per_min - dpm_mean) / dpm_std
-                if dpm_z > ANOMALY_THRESHOLD:
-                    if match.damage_per_min > dpm_mean:
-                        reasons.append(
-                            f"Very high damage ({int(match.damage_per_min)} DPM)"
-                        )
-                    else:
-                        reasons.append(
-                            f"Very low damage ({int(match.damage_per_min)} DPM)"
-                        )
-
-            if gpm_std > 0:
-                gpm_z = abs(match.gold_per_min - gpm_mean) / gpm_std
-                if gpm_z > ANOMALY_THRESHOLD:
-                    if match.gold_per_min > gpm_mean:
-                        reasons.append(
-                            f"Very high gold ({int(match.gold_per_min)} GPM)"
-                        )
-                    else:
-                        reasons.append(f"Very low gold ({int(match.gold_per_min)} GPM)")
-
-            if dur_std > 0:
-                dur_z = abs(match.game_duration - dur_mean) / dur_std
-                if dur_z > ANOMALY_THRESHOLD:
-                    mins = match.game_duration // 60
-                    if match.game_duration < dur_mean:
-                        reasons.append(f"Very short game ({mins} min)")
-                    else:
-                        reasons.append(f"Very long game ({mins} min)")
-
-            if reasons:
-                match.is_anomaly = True
-                match.anomaly_reason = "; ".join(reasons)
-            else:
-                match.is_anomaly = False
-                match.anomaly_reason = None
+    return scores[scores["is_anomaly"]]
 
 
 def generate_insights(player_summary):
@@ -209,20 +533,23 @@ def generate_insights(player_summary):
     return pd.DataFrame(insights)
 
 
-def run_analysis():
+def run_analysis(rescore=False):
     print("=" * 50)
     print("ANALYSIS")
     print("=" * 50)
 
     with get_session() as session:
         print("Calculating player summaries...")
-        player_summary = calculate_player_summary(session)
+        with METRICS.timer("analysis_step", step="player_summary"):
+            player_summary = calculate_player_summary(session)
 
         print("Detecting anomalies...")
-        detect_anomalies(session)
+        with METRICS.timer("analysis_step", step="anomalies"):
+            detect_anomalies(session, rescore=rescore)
 
         print("Generating insights...")
-        insights = generate_insights(player_summary)
+        with METRICS.timer("analysis_step", step="insights"):
+            insights = generate_insights(player_summary)
 
         print()
         print("Player Summary:")
@@ -244,4 +571,4 @@ def run_analysis():
 
 
 if __name__ == "__main__":
-    run_analysis()
+    run_analysis(rescore="--rescore" in sys.argv)
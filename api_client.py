@@ -1,103 +1,152 @@
 import os
+import time
 import requests
 from dotenv import load_dotenv
-from riotwatcher import LolWatcher
+from riotwatcher import LolWatcher, ApiError
 
-from config import REGION, REGIONAL, MATCH_COUNT, DDRAGON_BASE, DDRAGON_VERSION
+from config import (
+    REGION,
+    REGIONAL,
+    MATCH_COUNT,
+    DDRAGON_BASE,
+    API_MAX_RETRIES,
+    HTTP_TRANSPORT,
+)
+from ddragon import DataDragonCatalog, cached_version, latest_version
+from rate_limit import RateLimitScheduler
+from raw_store import RawMatchStore
+from transport import create_session
+from metrics import METRICS
 
 load_dotenv()
 
 
-class ApiClient:
+class StaticDataClient:
+    def __init__(self, version=None, session=None):
+        # Without a session nothing is fetched: the version and datasets come
+        # from the Data Dragon disk cache
+        self.version = version or cached_version()
+        self.catalog = DataDragonCatalog(self.version, session=session)
+
+    def get_champion_icon_url(self, champion_name, champion_id=None):
+        image = self.catalog.champion_image(champion_name, champion_id)
+        return f"{DDRAGON_BASE}/{self.version}/img/champion/{image}"
+
+    def get_item_icon_url(self, item_id):
+        if not item_id or item_id == 0:
+            return None
+        image = self.catalog.item_image(item_id)
+        return f"{DDRAGON_BASE}/{self.version}/img/item/{image}"
+
+    def get_profile_icon_url(self, icon_id):
+        image = self.catalog.profile_icon_image(icon_id)
+        return f"{DDRAGON_BASE}/{self.version}/img/profileicon/{image}"
+
+    def get_spell_icon_url(self, spell_id):
+        image = self.catalog.spell_image(spell_id)
+        if not image:
+            return None
+        return f"{DDRAGON_BASE}/{self.version}/img/spell/{image}"
+
+    def get_item_name(self, item_id):
+        if not item_id or item_id == 0:
+            return None
+        return self.catalog.item_name(item_id) or f"Item {item_id}"
+
+
+class ApiClient(StaticDataClient):
     def __init__(self):
         self.api_key = os.getenv("RIOT_API_KEY")
-        self.watcher = LolWatcher(self.api_key)
-        self.version = self.get_latest_version()
+        if not self.api_key and HTTP_TRANSPORT == "replay":
+            self.api_key = "replay"
 
-    def get_latest_version(self):
-        try:
-            response = requests.get(
-                "https://ddragon.leagueoflegends.com/api/versions.json", timeout=10
+        # One pooled keep-alive session for our own calls and riotwatcher's,
+        # so connections are reused and the transport adapter sees every request
+        self.session, adapter = create_session(HTTP_TRANSPORT)
+        self.transport = adapter if HTTP_TRANSPORT != "live" else None
+
+        self.scheduler = RateLimitScheduler()
+        self.watcher = LolWatcher(self.api_key, rate_limiter=self.scheduler)
+        self.share_session()
+        super().__init__(self.get_latest_version(), session=self.session)
+        self.raw_store = RawMatchStore()
+
+    def share_session(self):
+        # riotwatcher has no public hook for its HTTP session, so this relies on
+        # the internals of the pinned version and fails loudly if they change
+        base_api = getattr(self.watcher, "_base_api", None)
+        if not isinstance(getattr(base_api, "_session", None), requests.Session):
+            raise RuntimeError(
+                "riotwatcher no longer exposes _base_api._session; "
+                "install the version pinned in pyproject.toml"
             )
-            if response.status_code == 200:
-                versions = response.json()
-                return versions[0] if versions else DDRAGON_VERSION
-        except:
-            pass
-        return DDRAGON_VERSION
+        base_api._session = self.session
 
+    @METRICS.timed("api_call", method="get_latest_version")
+    def get_latest_version(self):
+        return latest_version(self.session)
+
+    def with_retries(self, call, *args, **kwargs):
+        for attempt in range(API_MAX_RETRIES + 1):
+            try:
+                return call(*args, **kwargs)
+            except ApiError as e:
+                status = e.response.status_code
+                if attempt == API_MAX_RETRIES or (status != 429 and status < 500):
+                    raise
+                METRICS.count("api_retries", method=call.__name__, status=status)
+                if status >= 500:
+                    time.sleep(2**attempt)
+
+    @METRICS.timed("api_call", method="get_account")
     def get_account(self, name, tag):
+        return self.with_retries(self.fetch_account, name, tag)
+
+    def fetch_account(self, name, tag):
         url = f"https://{REGIONAL}.api.riotgames.com/riot/account/v1/accounts/by-riot-id/{name}/{tag}"
         headers = {"X-Riot-Token": self.api_key}
-        response = requests.get(url, headers=headers, timeout=30)
+
+        delay = self.scheduler.acquire(REGIONAL, "AccountApiV1", "by_riot_id")
+        if delay > 0:
+            time.sleep(delay)
+        response = self.session.get(url, headers=headers, timeout=30)
+        self.scheduler.record_response(
+            REGIONAL,
+            "AccountApiV1",
+            "by_riot_id",
+            response.status_code,
+            response.headers,
+        )
+        # riotwatcher's ApiError is requests' HTTPError, so with_retries
+        # retries 429s and 5xx errors here like for every other call
+        response.raise_for_status()
         return response.json()
 
+    @METRICS.timed("api_call", method="get_summoner")
     def get_summoner(self, puuid):
-        return self.watcher.summoner.by_puuid(REGION, puuid)
+        return self.with_retries(self.watcher.summoner.by_puuid, REGION, puuid)
 
-    def get_match_ids(self, puuid):
-        return self.watcher.match.matchlist_by_puuid(REGIONAL, puuid, count=MATCH_COUNT)
+    @METRICS.timed("api_call", method="get_match_ids")
+    def get_match_ids(
+        self, puuid, start=0, count=MATCH_COUNT, start_time=None, end_time=None
+    ):
+        return self.with_retries(
+            self.watcher.match.matchlist_by_puuid,
+            REGIONAL,
+            puuid,
+            start=start,
+            count=count,
+            start_time=start_time,
+            end_time=end_time,
+        )
 
     def get_match(self, match_id):
-        return self.watcher.match.by_id(REGIONAL, match_id)
-
-    def get_champion_icon_url(self, champion_name):
-        fixed_name = self.fix_champion_name(champion_name)
-        return f"{DDRAGON_BASE}/{self.version}/img/champion/{fixed_name}.png"
-
-    def get_item_icon_url(self, item_id):
-        if not item_id or item_id == 0:
-            return None
-        return f"{DDRAGON_BASE}/{self.version}/img/item/{item_id}.png"
-
-    def get_profile_icon_url(self, icon_id):
-        return f"{DDRAGON_BASE}/{self.version}/img/profileicon/{icon_id}.png"
+        match = self.raw_store.get(match_id)
+        if match:
+            METRICS.count("raw_store_hits")
+            return match
 
-    def get_spell_icon_url(self, spell_id):
-        spell_names = {
-            1: "SummonerBoost",
-            3: "SummonerExhaust",
-            4: "SummonerFlash",
-            6: "SummonerHaste",
-            7: "SummonerHeal",
-            11: "SummonerSmite",
-            12: "SummonerTeleport",
-            13: "SummonerMana",
-            14: "SummonerDot",
-            21: "SummonerBarrier",
-            32: "SummonerSnowball",
-        }
-        spell_name = spell_names.get(spell_id)
-        if not spell_name:
-            return None
-        return f"{DDRAGON_BASE}/{self.version}/img/spell/{spell_name}.png"
-
-    def fix_champion_name(self, name):
-        fixes = {
-            "Kai'Sa": "Kaisa",
-            "Kha'Zix": "Khazix",
-            "Vel'Koz": "Velkoz",
-            "Cho'Gath": "Chogath",
-            "Rek'Sai": "RekSai",
-            "Kog'Maw": "KogMaw",
-            "LeBlanc": "Leblanc",
-            "Wukong": "MonkeyKing",
-            "Nunu & Willump": "Nunu",
-            "Renata Glasc": "Renata",
-        }
-        return fixes.get(name, name)
-
-    def get_item_name(self, item_id):
-        if not item_id or item_id == 0:
-            return None
-        try:
-            url = f"{DDRAGON_BASE}/{self.version}/data/en_US/item.json"
-            response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                item_data = data["data"].get(str(item_id))
-                if item_data:
-                    return item_data["name"]
-        except:
-            pass
-        return f"Item {item_id}"
+        with METRICS.timer("api_call", method="get_match"):
+            match = self.with_retries(self.watcher.match.by_id, REGIONAL, match_id)
+        self.raw_store.put(match_id, match)
+        return match
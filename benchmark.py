@@ -0,0 +1,502 @@
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+import contextlib
+from datetime import datetime
+
+import numpy as np
+
+from database import get_session, init_db, get_or_create_player, use_database
+from extract import extract_match_records, extract_tracked_rows, BatchWriter
+from analysis import calculate_player_summary, detect_anomalies, generate_insights
+from export import run_export
+from config import (
+    DDRAGON_BASE,
+    DDRAGON_VERSION,
+    DATABASE_URL,
+    EXPORT_FORMATS,
+    BENCHMARK_SIZES,
+    BENCHMARK_PLAYERS,
+    BENCHMARK_OUTPUT_DIR,
+)
+
+
+SAMPLE_MATCH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "sample_match.json"
+)
+
+CHAMPIONS = [
+    "Ahri",
+    "Akali",
+    "Ashe",
+    "Caitlyn",
+    "Darius",
+    "Diana",
+    "Ekko",
+    "Ezreal",
+    "Fiora",
+    "Garen",
+    "Graves",
+    "Irelia",
+    "Jax",
+    "Jhin",
+    "Jinx",
+    "Kaisa",
+    "Karma",
+    "Katarina",
+    "Kayn",
+    "LeeSin",
+    "Leona",
+    "Lux",
+    "Malphite",
+    "MissFortune",
+    "Morgana",
+    "Nami",
+    "Nasus",
+    "Nautilus",
+    "Orianna",
+    "Pyke",
+    "Riven",
+    "Sett",
+    "Sylas",
+    "Thresh",
+    "Udyr",
+    "Varus",
+    "Vayne",
+    "Viktor",
+    "Yasuo",
+    "Zed",
+]
+
+SPELL_PAIRS = [(4, 14), (4, 12), (4, 11), (4, 7), (4, 3), (4, 6), (12, 4), (14, 4)]
+TRINKETS = [3340, 3363, 3364]
+REMAKE_RATE = 0.02
+CHUNK_SIZE = 500
+
+
+class SyntheticClient:
+    version = DDRAGON_VERSION
+
+    def get_champion_icon_url(self, champion_name):
+        return f"{DDRAGON_BASE}/{self.version}/img/champion/{champion_name}.png"
+
+    def get_item_icon_url(self, item_id):
+        if not item_id:
+            return None
+        return f"{DDRAGON_BASE}/{self.version}/img/item/{item_id}.png"
+
+    def get_spell_icon_url(self, spell_id):
+        if not spell_id:
+            return None
+        return f"{DDRAGON_BASE}/{self.version}/img/spell/Summoner{spell_id}.png"
+
+    def get_item_name(self, item_id):
+        if not item_id:
+            return None
+        return f"Item {item_id}"
+
+
+def load_sample_match():
+    with open(SAMPLE_MATCH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def player_profiles(rng, players):
+    profiles = []
+    for index in range(players):
+        pool = rng.choice(CHAMPIONS, size=8, replace=False)
+        weights = 1 / np.arange(1, len(pool) + 1)
+        profiles.append(
+            {
+                "puuid": f"bench-player-{index:04d}",
+                "name": f"Bench{index:04d}",
+                "skill": max(rng.normal(1.0, 0.15), 0.5),
+                "win_rate": float(np.clip(rng.normal(0.5, 0.04), 0.35, 0.65)),
+                "pool": pool,
+                "weights": weights / weights.sum(),
+            }
+        )
+    return profiles
+
+
+def synthetic_participants(rng, count, minutes, skill, slot):
+    pace = minutes / 30
+    scale = np.ones(count)
+    scale[slot] = skill
+
+    kills = rng.poisson(5 * pace * scale)
+    deaths = rng.poisson(5 * pace / scale)
+    assists = rng.poisson(7 * pace * scale)
+    damage = rng.lognormal(np.log(600 * scale), 0.35) * minutes
+    cs = np.clip(rng.normal(6, 1.5, count), 0.5, None) * minutes
+    gold = (rng.normal(380, 40, count) * minutes + kills * 300).clip(500)
+    vision = rng.lognormal(np.log(0.9), 0.4, count) * minutes
+    objectives = damage * rng.uniform(0.5, 3, count)
+    wards = rng.poisson(minutes * 0.4, count)
+    control_wards = rng.poisson(minutes * 0.1, count)
+    return {
+        "kills": kills,
+        "deaths": deaths,
+        "assists": assists,
+        "goldEarned": gold.astype(int),
+        "totalMinionsKilled": (cs * 0.85).astype(int),
+        "neutralMinionsKilled": (cs * 0.15).astype(int),
+        "totalDamageDealtToChampions": damage.astype(int),
+        "damageDealtToObjectives": objectives.astype(int),
+        "visionScore": vision.astype(int),
+        "wardsPlaced": wards,
+        "detectorWardsPlaced": control_wards,
+    }
+
+
+def generate_matches(players, matches_per_player, seed=0):
+    rng = np.random.default_rng(seed)
+    sample = load_sample_match()
+    info = sample["info"]
+    template = info["participants"]
+    count = len(template)
+    teams = np.array([p["teamId"] for p in template])
+    item_pool = np.array(
+        sorted({p[f"item{i}"] for p in template for i in range(6) if p[f"item{i}"]})
+    )
+    profiles = player_profiles(rng, players)
+    clocks = [info["gameCreation"]] * players
+
+    for number in range(matches_per_player):
+        for index, profile in enumerate(profiles):
+            clocks[index] += int(rng.exponential(8 * 3600 * 1000))
+            slot = int(rng.integers(count))
+            remake = bool(rng.random() < REMAKE_RATE)
+            if remake:
+                seconds = int(rng.integers(180, 240))
+            else:
+                seconds = int(np.clip(rng.normal(31, 6), 15, 55) * 60)
+
+            team = teams[slot]
+            winner = team if rng.random() < profile["win_rate"] else 300 - team
+            stats = synthetic_participants(
+                rng, count, seconds / 60, profile["skill"], slot
+            )
+
+            team_kills = (
+                np.where(teams == 100, stats["kills"], 0).sum(),
+                np.where(teams == 200, stats["kills"], 0).sum(),
+            )
+            team_damage = (
+                np.where(teams == 100, stats["totalDamageDealtToChampions"], 0).sum(),
+                np.where(teams == 200, stats["totalDamageDealtToChampions"], 0).sum(),
+            )
+            is_blue = teams == 100
+            kill_participation = (stats["kills"] + stats["assists"]) / np.maximum(
+                np.where(is_blue, team_kills[0], team_kills[1]), 1
+            )
+            damage_share = stats["totalDamageDealtToChampions"] / np.maximum(
+                np.where(is_blue, team_damage[0], team_damage[1]), 1
+            )
+
+            champions = np.array(CHAMPIONS)[rng.integers(len(CHAMPIONS), size=count)]
+            champions[slot] = rng.choice(profile["pool"], p=profile["weights"])
+            strangers = rng.integers(10**9, size=count)
+            items = item_pool[
+                rng.random((count, len(item_pool))).argsort(axis=1)[:, :6]
+            ]
+            spells = rng.integers(len(SPELL_PAIRS), size=count)
+            trinkets = rng.integers(len(TRINKETS), size=count)
+
+            participants = []
+            for i, p in enumerate(template):
+                puuid = (
+                    profile["puuid"] if i == slot else f"bench-other-{strangers[i]:09d}"
+                )
+                participants.append(
+                    {
+                        **p,
+                        **{key: int(values[i]) for key, values in stats.items()},
+                        "puuid": puuid,
+                        "championName": str(champions[i]),
+                        "win": bool(teams[i] == winner),
+                        "gameEndedInEarlySurrender": remake,
+                        "summoner1Id": SPELL_PAIRS[spells[i]][0],
+                        "summoner2Id": SPELL_PAIRS[spells[i]][1],
+                        **{f"item{k}": int(items[i, k]) for k in range(6)},
+                        "item6": TRINKETS[trinkets[i]],
+                        "challenges": {
+                            **p.get("challenges", {}),
+                            "killParticipation": float(kill_participation[i]),
+                            "teamDamagePercentage": float(damage_share[i]),
+                        },
+                    }
+                )
+
+            game_id = number * players + index
+            yield {
+                "metadata": {
+                    **sample["metadata"],
+                    "matchId": f"BENCH_{game_id}",
+                    "participants": [p["puuid"] for p in participants],
+                },
+                "info": {
+                    **info,
+                    "gameId": game_id,
+                    "gameCreation": clocks[index],
+                    "gameStartTimestamp": clocks[index],
+                    "gameEndTimestamp": clocks[index] + seconds * 1000,
+                    "gameDuration": seconds,
+                    "participants": participants,
+                    "teams": [
+                        {**t, "win": t["teamId"] == winner} for t in info["teams"]
+                    ],
+                },
+            }
+
+
+def match_chunks(players, matches_per_player, chunk_size=CHUNK_SIZE):
+    chunk = []
+    for match in generate_matches(players, matches_per_player):
+        chunk.append(match)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class StageTimer:
+    def __init__(self):
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds += time.perf_counter() - self.start
+
+
+@contextlib.contextmanager
+def measure(results, stage, rows, trace_memory):
+    timer = StageTimer()
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield timer
+    finally:
+        result = {
+            "seconds": round(timer.seconds, 4),
+            "rows": rows,
+            "rows_per_second": (
+                round(rows / timer.seconds, 1) if timer.seconds > 0 else None
+            ),
+        }
+        if trace_memory:
+            result["peak_memory_mb"] = round(
+                tracemalloc.get_traced_memory()[1] / 1024**2, 2
+            )
+            tracemalloc.stop()
+        results[stage] = result
+
+
+def create_players(session, players):
+    client = SyntheticClient()
+    tracked = {}
+    for profile in player_profiles(np.random.default_rng(0), players):
+        player = get_or_create_player(
+            session,
+            profile["puuid"],
+            profile["name"],
+            "BENCH",
+            100,
+            client.get_champion_icon_url("Ahri"),
+        )
+        tracked[profile["puuid"]] = player.id
+    session.commit()
+    return tracked
+
+
+def parse_match(client, match, tracked):
+    rows = {player_id: [] for player_id in tracked.values()}
+    extract_tracked_rows(client, match, tracked, rows)
+    return extract_match_records(match), rows
+
+
+def run_size(total, players, formats, trace_memory):
+    matches_per_player = max(total // players, 1)
+    total = matches_per_player * players
+    client = SyntheticClient()
+    stages = {}
+
+    init_db()
+    with get_session() as session:
+        tracked = create_players(session, players)
+
+        # Matches are generated in chunks outside the timers, so only the
+        # pipeline code is timed; peak memory includes one chunk of input
+        with measure(stages, "parse", total, trace_memory) as timer:
+            for chunk in match_chunks(players, matches_per_player):
+                with timer:
+                    for match in chunk:
+                        parse_match(client, match, tracked)
+
+        writer = BatchWriter(session, tracked.values())
+        with measure(stages, "ingest", total, trace_memory) as timer:
+            for chunk in match_chunks(players, matches_per_player):
+                parsed = [parse_match(client, match, tracked) for match in chunk]
+                with timer:
+                    for records, rows in parsed:
+                        writer.add(records, rows)
+            with timer:
+                writer.flush()
+
+        with measure(stages, "summary", total, trace_memory) as timer, timer:
+            player_summary = calculate_player_summary(session)
+
+        with measure(stages, "anomalies", total, trace_memory) as timer, timer:
+            detect_anomalies(session)
+            session.commit()
+
+        rows = len(player_summary)
+        with measure(stages, "insights", rows, trace_memory) as timer, timer:
+            generate_insights(player_summary)
+
+    with measure(stages, "export", total, trace_memory) as timer, timer:
+        run_export(formats, incremental=False)
+
+    return {"matches": total, "players": players, "stages": stages}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def max_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_isolated(size, players, formats, trace_memory):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        use_database(f"sqlite:///{os.path.join(workdir, 'benchmark.db')}")
+        try:
+            return run_size(size, players, formats, trace_memory)
+        finally:
+            use_database(DATABASE_URL)
+            os.chdir(cwd)
+
+
+def run_benchmark(
+    sizes=BENCHMARK_SIZES,
+    players=BENCHMARK_PLAYERS,
+    formats=EXPORT_FORMATS,
+    trace_memory=True,
+    output_dir=BENCHMARK_OUTPUT_DIR,
+):
+    print("=" * 50)
+    print("BENCHMARK")
+    print("=" * 50)
+
+    output_dir = os.path.abspath(output_dir)
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "formats": list(formats),
+        "trace_memory": trace_memory,
+        "results": [],
+    }
+
+    for size in sizes:
+        print(f"Running {size} matches across {players} players...")
+        result = run_isolated(size, players, formats, trace_memory=False)
+
+        # Tracing slows Python down, so memory comes from a separate pass
+        if trace_memory:
+            traced = run_isolated(size, players, formats, trace_memory=True)
+            for stage, timing in traced["stages"].items():
+                result["stages"][stage]["peak_memory_mb"] = timing["peak_memory_mb"]
+
+        report["results"].append(result)
+        for stage, timing in result["stages"].items():
+            memory = timing.get("peak_memory_mb")
+            memory = f", peak {memory} MB" if memory is not None else ""
+            print(f"  {stage}: {timing['seconds']:.3f}s{memory}")
+
+    report["max_rss_mb"] = max_rss_mb()
+
+    os.makedirs(output_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(output_dir, f"{stamp}-{report['commit'] or 'nocommit'}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print()
+    print(f"Results saved to {path}")
+    return report
+
+
+def compare_results(base_path, current_path):
+    with open(base_path, encoding="utf-8") as f:
+        base = {r["matches"]: r["stages"] for r in json.load(f)["results"]}
+    with open(current_path, encoding="utf-8") as f:
+        current = {r["matches"]: r["stages"] for r in json.load(f)["results"]}
+
+    print(f"{'matches':>8} {'stage':<10} {'base':>9} {'current':>9} {'change':>8}")
+    for matches in sorted(base.keys() & current.keys()):
+        for stage, timing in current[matches].items():
+            if stage not in base[matches]:
+                continue
+            before = base[matches][stage]["seconds"]
+            after = timing["seconds"]
+            change = f"{(after / before - 1) * 100:+.1f}%" if before else "n/a"
+            print(
+                f"{matches:>8} {stage:<10} {before:>8.3f}s {after:>8.3f}s {change:>8}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark")
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in BENCHMARK_SIZES),
+        help="comma-separated match counts",
+    )
+    parser.add_argument("--players", type=int, default=BENCHMARK_PLAYERS)
+    parser.add_argument("--formats", default=",".join(EXPORT_FORMATS))
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--output-dir", default=BENCHMARK_OUTPUT_DIR)
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "CURRENT"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+        sys.exit(0)
+
+    run_benchmark(
+        sizes=[int(size) for size in args.sizes.split(",")],
+        players=args.players,
+        formats=args.formats.split(","),
+        trace_memory=not args.no_memory,
+        output_dir=args.output_dir,
+    )
@@ -1,3 +1,5 @@
+# Each player may set "retention" (how many matches to keep, None keeps all)
+# and "retention_days" (drop matches older than this many days).
 PLAYERS = [
     {"name": "Kashtanchik", "tag": "K6M9S"},
     {"name": "Kashtanova", "tag": "K6M9S"},
@@ -8,10 +10,78 @@ PLAYERS = [
 REGION = "ru"
 REGIONAL = "europe"
 MATCH_COUNT = 50
+RETENTION_DAYS = None
+
+INCREMENTAL_EXTRACTION = True
+
+BACKFILL_SINCE = "2026-01-08"
+BACKFILL_PAGE_SIZE = 100
+FETCH_WORKERS = 8
+PARSE_WORKERS = 2
+PIPELINE_QUEUE_SIZE = 64
+WRITE_BATCH_SIZE = 100
+API_MAX_RETRIES = 3
+RIOT_APP_RATE_LIMITS = "20:1,100:120"
+
+# "live" talks to Riot, "record" also saves every response to RECORDINGS_DIR,
+# "replay" serves the saved responses without touching the network
+HTTP_TRANSPORT = "live"
+# One keep-alive pool per host (platform, regional and Data Dragon), each
+# large enough for every fetch worker
+HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_MAXSIZE = FETCH_WORKERS + 2
+RECORDINGS_DIR = "recordings"
+REPLAY_LATENCY_MS = 80
+REPLAY_JITTER_MS = 40
+# 0 replays instantly, 1 keeps the simulated latency as is
+REPLAY_LATENCY_SCALE = 1.0
+REPLAY_RATE_LIMITS = RIOT_APP_RATE_LIMITS
+REPLAY_THROTTLE_RATE = 0.0
+REPLAY_ERROR_RATE = 0.0
+REPLAY_SEED = 0
 
 DATABASE_URL = "sqlite:///lol_dashboard.db"
+INSERT_CHUNK_SIZE = 500
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "cache_size": -64 * 1024,
+    "busy_timeout": 5000,
+    "foreign_keys": "ON",
+}
+
+RAW_STORE_DIR = "raw_matches"
+RAW_SEGMENT_SIZE = 64 * 1024 * 1024
 
 DDRAGON_VERSION = "14.24.1"
 DDRAGON_BASE = "https://ddragon.leagueoflegends.com/cdn"
+DDRAGON_LOCALE = "en_US"
+DDRAGON_CACHE_DIR = "ddragon_cache"
 
 ANOMALY_THRESHOLD = 2.5
+# One of "moments", "rolling", "robust" or "champion"
+ANOMALY_DETECTOR = "moments"
+ANOMALY_WINDOW = 20
+# Games shorter than this (in seconds) are remakes and never used as a baseline
+REMAKE_MAX_DURATION = 300
+
+EXPORT_FORMATS = ["csv"]
+EXPORT_INCREMENTAL = True
+EXPORT_MAX_PARTITIONS = 24
+PARQUET_COMPRESSION = "zstd"
+ARROW_COMPRESSION = "zstd"
+
+PIPELINE_STATE_FILE = "pipeline_state.json"
+
+# Run report (JSON) and Prometheus textfile metrics are written here
+METRICS_DIR = "metrics"
+# Stages to profile, e.g. ["analyze"]; PROFILER is "cprofile" or "pyinstrument"
+PROFILE_STAGES = []
+PROFILER = "cprofile"
+
+BENCHMARK_SIZES = [1000, 10000, 100000]
+BENCHMARK_PLAYERS = 10
+BENCHMARK_OUTPUT_DIR = "benchmark_results"
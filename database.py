@@ -1,19 +1,458 @@
+import re
+import json
+import time
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, delete, event, func, inspect, or_, select, text
+from sqlalchemy import column as sql_column, table as sql_table
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import sessionmaker
 
-from config import DATABASE_URL, MATCH_COUNT
-from models import Base, Player, MatchHistory
+from config import (
+    DATABASE_URL,
+    MATCH_COUNT,
+    INSERT_CHUNK_SIZE,
+    SQLITE_PRAGMAS,
+    REMAKE_MAX_DURATION,
+)
+from models import (
+    Base,
+    Player,
+    MatchHistory,
+    Item,
+    SummonerSpell,
+    MatchItem,
+    MatchSpell,
+    Match,
+    MatchTeam,
+    MatchObjective,
+    MatchParticipant,
+    MatchHistoryDeletion,
+    BackfillCursor,
+    ChampionStats,
+    MetricMoments,
+)
+from metrics import METRICS
 
 
 engine = create_engine(DATABASE_URL)
 Session = sessionmaker(bind=engine)
 
 
+@event.listens_for(engine, "connect")
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    if engine.dialect.name != "sqlite":
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+@event.listens_for(Session, "before_commit")
+def start_commit_timer(session):
+    session.info["commit_started"] = time.perf_counter()
+
+
+@event.listens_for(Session, "after_commit")
+def record_commit_time(session):
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        METRICS.observe("db_commit", time.perf_counter() - started)
+
+
+def use_database(url):
+    global engine
+    engine.dispose()
+    engine = create_engine(url)
+    event.listen(engine, "connect", apply_sqlite_pragmas)
+    Session.configure(bind=engine)
+    return engine
+
+
+MATCH_COLUMNS = [
+    column.name
+    for column in MatchHistory.__table__.columns
+    if column.name
+    not in (
+        "id",
+        "player_id",
+        "is_anomaly",
+        "anomaly_reason",
+        "updated_at",
+        "scored_threshold",
+        "scored_detector",
+        "items",
+        "summoner_spells",
+    )
+]
+
+DDRAGON_VERSION_PATTERN = re.compile(r"/cdn/([^/]+)/img/")
+
+PLAYER_PARTICIPANTS_VIEW = """
+CREATE VIEW IF NOT EXISTS player_match_participants AS
+SELECT
+    players.id AS player_id,
+    players.name AS player_name,
+    matches.game_date,
+    matches.game_duration,
+    matches.queue_id,
+    match_participants.*
+FROM players
+JOIN match_participants ON match_participants.puuid = players.puuid
+JOIN matches ON matches.match_id = match_participants.match_id
+"""
+
+# Items and spells of each match row as JSON arrays in slot order, with the
+# names and icons of the Data Dragon version the match was parsed with
+MATCH_SLOTS_VIEW = """
+CREATE VIEW match_history_slots AS
+SELECT
+    match_history.id AS match_history_id,
+    (
+        SELECT json_group_array(json_object(
+            'id', match_items.item_id,
+            'name', items.name,
+            'icon_url', items.icon_url
+        ))
+        FROM (
+            SELECT * FROM match_items
+            WHERE match_items.match_history_id = match_history.id
+            ORDER BY slot
+        ) AS match_items
+        LEFT JOIN items ON items.item_id = match_items.item_id
+            AND items.version = match_history.ddragon_version
+    ) AS items,
+    (
+        SELECT json_group_array(json_object(
+            'id', match_spells.spell_id,
+            'icon_url', summoner_spells.icon_url
+        ))
+        FROM (
+            SELECT * FROM match_spells
+            WHERE match_spells.match_history_id = match_history.id
+            ORDER BY slot
+        ) AS match_spells
+        LEFT JOIN summoner_spells ON summoner_spells.spell_id = match_spells.spell_id
+            AND summoner_spells.version = match_history.ddragon_version
+    ) AS summoner_spells
+FROM match_history
+"""
+
+match_history_slots = sql_table(
+    "match_history_slots",
+    sql_column("match_history_id"),
+    sql_column("items"),
+    sql_column("summoner_spells"),
+)
+
+CHAMPION_STAT_SUMS = [
+    "kills",
+    "deaths",
+    "assists",
+    "game_duration",
+    "gold_earned",
+    "cs",
+    "total_damage",
+    "vision_score",
+]
+
+
+def champion_stats_add(row):
+    columns = ", ".join(CHAMPION_STAT_SUMS)
+    values = ", ".join(f"COALESCE({row}.{column}, 0)" for column in CHAMPION_STAT_SUMS)
+    updates = ", ".join(
+        f"{column} = {column} + excluded.{column}"
+        for column in ["games", "wins", *CHAMPION_STAT_SUMS]
+    )
+    return (
+        "INSERT INTO champion_stats "
+        f"(player_id, champion_name, champion_icon_url, games, wins, {columns}) "
+        f"VALUES ({row}.player_id, {row}.champion_name, {row}.champion_icon_url, "
+        f"1, COALESCE({row}.win, 0), {values}) "
+        "ON CONFLICT (player_id, champion_name) DO UPDATE SET "
+        f"champion_icon_url = excluded.champion_icon_url, {updates};"
+    )
+
+
+def champion_stats_subtract(row):
+    updates = ", ".join(
+        f"{column} = {column} - COALESCE({row}.{column}, 0)"
+        for column in CHAMPION_STAT_SUMS
+    )
+    where = (
+        f"WHERE player_id = {row}.player_id " f"AND champion_name = {row}.champion_name"
+    )
+    return (
+        "UPDATE champion_stats SET games = games - 1, "
+        f"wins = wins - COALESCE({row}.win, 0), {updates} {where}; "
+        f"DELETE FROM champion_stats {where} AND games <= 0;"
+    )
+
+
+CHAMPION_STATS_TRIGGERS = {
+    "champion_stats_insert": (
+        "AFTER INSERT ON match_history",
+        champion_stats_add("NEW"),
+    ),
+    "champion_stats_delete": (
+        "AFTER DELETE ON match_history",
+        champion_stats_subtract("OLD"),
+    ),
+    "champion_stats_update": (
+        "AFTER UPDATE OF player_id, champion_name, champion_icon_url, win, "
+        f"{', '.join(CHAMPION_STAT_SUMS)} ON match_history",
+        champion_stats_subtract("OLD") + " " + champion_stats_add("NEW"),
+    ),
+}
+
+
+MOMENT_METRICS = ["kda", "deaths", "damage_per_min", "gold_per_min", "game_duration"]
+
+
+def moments_add(row, metric):
+    value = f"CAST({row}.{metric} AS REAL)"
+    delta = "(excluded.mean - mean)"
+    return (
+        "INSERT INTO metric_moments (player_id, metric, count, mean, m2) "
+        f"SELECT {row}.player_id, '{metric}', 1, {value}, 0.0 "
+        f"WHERE {row}.{metric} IS NOT NULL "
+        f"AND {row}.game_duration >= {REMAKE_MAX_DURATION} "
+        "ON CONFLICT (player_id, metric) DO UPDATE SET "
+        f"count = count + 1, mean = mean + {delta} / (count + 1), "
+        f"m2 = m2 + {delta} * ({delta} - {delta} / (count + 1));"
+    )
+
+
+def moments_remove(row, metric):
+    delta = f"(CAST({row}.{metric} AS REAL) - mean)"
+    return (
+        "UPDATE metric_moments SET count = count - 1, "
+        "mean = CASE WHEN count > 1 "
+        f"THEN (count * mean - {row}.{metric}) / (count - 1) ELSE 0.0 END, "
+        "m2 = CASE WHEN count > 1 "
+        f"THEN MAX(m2 - count * {delta} * {delta} / (count - 1), 0.0) ELSE 0.0 END "
+        f"WHERE player_id = {row}.player_id AND metric = '{metric}' "
+        f"AND {row}.{metric} IS NOT NULL "
+        f"AND {row}.game_duration >= {REMAKE_MAX_DURATION};"
+    )
+
+
+def moments_body(row, apply):
+    return " ".join(apply(row, metric) for metric in MOMENT_METRICS)
+
+
+MOMENTS_CLEANUP = "DELETE FROM metric_moments WHERE count <= 0;"
+
+MOMENTS_TRIGGERS = {
+    "metric_moments_insert": (
+        "AFTER INSERT ON match_history",
+        moments_body("NEW", moments_add),
+    ),
+    "metric_moments_delete": (
+        "AFTER DELETE ON match_history",
+        moments_body("OLD", moments_remove) + " " + MOMENTS_CLEANUP,
+    ),
+    "metric_moments_update": (
+        f"AFTER UPDATE OF player_id, {', '.join(MOMENT_METRICS)} ON match_history "
+        "WHEN "
+        + " OR ".join(
+            f"OLD.{column} IS NOT NEW.{column}"
+            for column in ["player_id", *MOMENT_METRICS]
+        ),
+        moments_body("OLD", moments_remove)
+        + " "
+        + MOMENTS_CLEANUP
+        + " "
+        + moments_body("NEW", moments_add)
+        + " UPDATE match_history SET scored_threshold = NULL WHERE id = NEW.id;",
+    ),
+}
+
+
+# Every deleted match row is logged so incremental exports can publish
+# tombstones instead of rewriting match_history
+DELETION_TRIGGERS = {
+    "match_history_deletions_log": (
+        "AFTER DELETE ON match_history",
+        "INSERT INTO match_history_deletions "
+        "(match_history_id, player_id, match_id, deleted_at) "
+        "VALUES (OLD.id, OLD.player_id, OLD.match_id, "
+        "datetime('now', 'localtime'));",
+    ),
+}
+
+
 def init_db():
     Base.metadata.create_all(engine)
+    migrate_db()
+
+
+def migrate_db():
+    inspector = inspect(engine)
+    match_indexes = {index["name"] for index in inspector.get_indexes("match_history")}
+
+    with engine.begin() as conn:
+        if "uq_match_history_player_match" not in match_indexes:
+            conn.execute(
+                text(
+                    "DELETE FROM match_history WHERE id NOT IN ("
+                    "SELECT MIN(id) FROM match_history GROUP BY player_id, match_id)"
+                )
+            )
+
+        created = False
+        for table in Base.metadata.sorted_tables:
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(
+                        text(
+                            f"ALTER TABLE {table.name} "
+                            f"ADD COLUMN {column.name} {column_type}"
+                        )
+                    )
+
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+                    created = True
+
+        migrated = migrate_json_slots(conn)
+        if migrated:
+            print(f"Migrated items and spells of {migrated} matches to match_items")
+        conn.execute(text(PLAYER_PARTICIPANTS_VIEW))
+        create_view(conn, "match_history_slots", MATCH_SLOTS_VIEW)
+        migrate_champion_stats(conn)
+        migrate_metric_moments(conn)
+        create_triggers(conn, DELETION_TRIGGERS)
+
+        if created:
+            conn.execute(text("ANALYZE"))
+
+
+def create_triggers(conn, definitions):
+    if engine.dialect.name != "sqlite":
+        return False
+
+    triggers = dict(
+        conn.execute(
+            text("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'")
+        ).all()
+    )
+
+    changed = False
+    for name, (event_clause, body) in definitions.items():
+        sql = f"CREATE TRIGGER {name} {event_clause} BEGIN {body} END"
+        if triggers.get(name) == sql:
+            continue
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+        conn.execute(text(sql))
+        changed = True
+    return changed
+
+
+def create_view(conn, name, sql):
+    sql = sql.strip()
+    existing = conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'view' AND name = :name"),
+        {"name": name},
+    ).scalar()
+    if existing == sql:
+        return
+    conn.execute(text(f"DROP VIEW IF EXISTS {name}"))
+    conn.execute(text(sql))
+
+
+def migrate_champion_stats(conn):
+    if create_triggers(conn, CHAMPION_STATS_TRIGGERS):
+        rebuild_champion_stats(conn)
+
+
+def migrate_metric_moments(conn):
+    if create_triggers(conn, MOMENTS_TRIGGERS):
+        rebuild_metric_moments(conn)
+
+
+def rebuild_champion_stats(conn):
+    sums = ", ".join(f"COALESCE(SUM({column}), 0)" for column in CHAMPION_STAT_SUMS)
+    conn.execute(delete(ChampionStats))
+    conn.execute(
+        text(
+            "INSERT INTO champion_stats "
+            "(player_id, champion_name, champion_icon_url, games, wins, "
+            f"{', '.join(CHAMPION_STAT_SUMS)}) "
+            "SELECT player_id, champion_name, MAX(champion_icon_url), COUNT(*), "
+            f"COALESCE(SUM(win), 0), {sums} "
+            "FROM match_history WHERE champion_name IS NOT NULL "
+            "GROUP BY player_id, champion_name"
+        )
+    )
+
+
+def rebuild_metric_moments(conn):
+    conn.execute(delete(MetricMoments))
+    for metric in MOMENT_METRICS:
+        conn.execute(
+            text(
+                "INSERT INTO metric_moments (player_id, metric, count, mean, m2) "
+                f"SELECT m.player_id, '{metric}', COUNT(*), s.mean, "
+                f"SUM((m.{metric} - s.mean) * (m.{metric} - s.mean)) "
+                "FROM match_history m JOIN ("
+                f"SELECT player_id, AVG({metric}) AS mean FROM match_history "
+                f"WHERE {metric} IS NOT NULL "
+                f"AND game_duration >= {REMAKE_MAX_DURATION} GROUP BY player_id"
+                ") s ON s.player_id = m.player_id "
+                f"WHERE m.{metric} IS NOT NULL "
+                f"AND m.game_duration >= {REMAKE_MAX_DURATION} GROUP BY m.player_id"
+            )
+        )
+
+
+def migrate_json_slots(conn):
+    rows = conn.execute(
+        text(
+            "SELECT id, ddragon_version, champion_icon_url, items, summoner_spells "
+            "FROM match_history WHERE items IS NOT NULL OR summoner_spells IS NOT NULL"
+        )
+    ).all()
+    if not rows:
+        return 0
+
+    matches = []
+    for row in rows:
+        items = json.loads(row.items) if row.items else None
+        spells = json.loads(row.summoner_spells) if row.summoner_spells else None
+
+        version = row.ddragon_version
+        urls = [row.champion_icon_url] + [item.get("icon_url") for item in items or []]
+        for url in urls:
+            found = DDRAGON_VERSION_PATTERN.search(url or "")
+            if version or found:
+                version = version or found.group(1)
+                break
+
+        matches.append(
+            {
+                "id": row.id,
+                "ddragon_version": version or "unknown",
+                "items": items,
+                "summoner_spells": spells,
+            }
+        )
+
+    add_match_slots(conn, {match["id"]: match for match in matches})
+    conn.execute(
+        text(
+            "UPDATE match_history SET items = NULL, summoner_spells = NULL, "
+            "ddragon_version = :ddragon_version WHERE id = :id"
+        ),
+        [{"id": m["id"], "ddragon_version": m["ddragon_version"]} for m in matches],
+    )
+    return len(matches)
 
 
 @contextmanager
@@ -29,71 +468,192 @@ def get_session():
         session.close()
 
 
+def upsert(table):
+    if engine.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
 def get_or_create_player(session, puuid, name, tag_line, level, profile_icon_url):
-    player = session.query(Player).filter_by(puuid=puuid).first()
-
-    if player:
-        player.name = name
-        player.tag_line = tag_line
-        player.level = level
-        player.profile_icon_url = profile_icon_url
-        player.updated_at = datetime.now()
+    values = {
+        "puuid": puuid,
+        "name": name,
+        "tag_line": tag_line,
+        "level": level,
+        "profile_icon_url": profile_icon_url,
+        "updated_at": datetime.now(),
+    }
+    stmt = upsert(Player.__table__).values(**values)
+    stmt = stmt.on_conflict_do_update(index_elements=["puuid"], set_=values)
+    player_id = session.execute(stmt.returning(Player.__table__.c.id)).scalar_one()
+
+    return session.get(Player, player_id, populate_existing=True)
+
+
+def insert_rows(session, table, rows, keys, on_conflict="ignore", update_columns=None):
+    if not rows:
+        return 0
+
+    stmt = upsert(table)
+    if on_conflict == "update":
+        if update_columns is None:
+            update_columns = [column for column in rows[0] if column not in keys]
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={column: stmt.excluded[column] for column in update_columns},
+        )
     else:
-        player = Player(
-            puuid=puuid,
-            name=name,
-            tag_line=tag_line,
-            level=level,
-            profile_icon_url=profile_icon_url,
-            updated_at=datetime.now(),
+        stmt = stmt.on_conflict_do_nothing(index_elements=keys)
+    return session.execute(stmt, rows).rowcount
+
+
+def add_match_slots(session, matches_by_row_id, on_conflict="ignore"):
+    items = {}
+    spells = {}
+    item_rows = []
+    spell_rows = []
+
+    for row_id, match_data in matches_by_row_id.items():
+        version = match_data["ddragon_version"]
+
+        for slot, item in enumerate(match_data["items"] or []):
+            items[(item["id"], version)] = {
+                "item_id": item["id"],
+                "version": version,
+                "name": item.get("name"),
+                "icon_url": item.get("icon_url"),
+            }
+            item_rows.append(
+                {"match_history_id": row_id, "slot": slot, "item_id": item["id"]}
+            )
+
+        for slot, spell in enumerate(match_data["summoner_spells"] or []):
+            if spell.get("id") is not None:
+                spells[(spell["id"], version)] = {
+                    "spell_id": spell["id"],
+                    "version": version,
+                    "icon_url": spell.get("icon_url"),
+                }
+            spell_rows.append(
+                {"match_history_id": row_id, "slot": slot, "spell_id": spell.get("id")}
+            )
+
+    insert_rows(session, Item.__table__, list(items.values()), ["item_id", "version"])
+    insert_rows(
+        session,
+        SummonerSpell.__table__,
+        list(spells.values()),
+        ["spell_id", "version"],
+    )
+    insert_rows(
+        session,
+        MatchItem.__table__,
+        item_rows,
+        ["match_history_id", "slot"],
+        on_conflict,
+    )
+    insert_rows(
+        session,
+        MatchSpell.__table__,
+        spell_rows,
+        ["match_history_id", "slot"],
+        on_conflict,
+    )
+
+
+def add_matches(
+    session, player_id, matches, chunk_size=INSERT_CHUNK_SIZE, on_conflict="ignore"
+):
+    # A repeated match_id would be counted once as existing but written twice,
+    # so only the copy the database would end up with is kept
+    unique = {}
+    for match_data in matches:
+        if on_conflict == "update" or match_data["match_id"] not in unique:
+            unique[match_data["match_id"]] = match_data
+    total = len(matches)
+    matches = list(unique.values())
+
+    updated_at = datetime.now()
+    rows = [
+        {
+            "player_id": player_id,
+            **{column: match_data[column] for column in MATCH_COLUMNS},
+            "is_anomaly": False,
+            "anomaly_reason": None,
+            "updated_at": updated_at,
+        }
+        for match_data in matches
+    ]
+
+    table = MatchHistory.__table__
+    inserted = 0
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start : start + chunk_size]
+        chunk_matches = {m["match_id"]: m for m in matches[start : start + chunk_size]}
+        in_chunk = (MatchHistory.player_id == player_id) & MatchHistory.match_id.in_(
+            list(chunk_matches)
         )
-        session.add(player)
-        session.flush()
 
-    return player
+        # An upsert's rowcount includes updated rows, so existing ones are
+        # counted first to keep the inserted/skipped split accurate
+        existing = 0
+        if on_conflict == "update":
+            existing = session.execute(
+                select(func.count(MatchHistory.id)).where(in_chunk)
+            ).scalar_one()
+
+        written = insert_rows(
+            session,
+            table,
+            chunk,
+            ["player_id", "match_id"],
+            on_conflict,
+            MATCH_COLUMNS + ["updated_at"],
+        )
+        inserted += written - existing
+
+        row_ids = session.execute(
+            select(MatchHistory.match_id, MatchHistory.id).where(in_chunk)
+        ).all()
+        add_match_slots(
+            session,
+            {row.id: chunk_matches[row.match_id] for row in row_ids},
+            on_conflict,
+        )
+
+    return inserted, total - inserted
+
+
+def add_match_records(session, records, chunk_size=INSERT_CHUNK_SIZE):
+    inserted = 0
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start : start + chunk_size]
+        inserted += insert_rows(
+            session, Match.__table__, [r["match"] for r in chunk], ["match_id"]
+        )
+        insert_rows(
+            session,
+            MatchParticipant.__table__,
+            [row for r in chunk for row in r["participants"]],
+            ["match_id", "participant_id"],
+        )
+        insert_rows(
+            session,
+            MatchTeam.__table__,
+            [row for r in chunk for row in r["teams"]],
+            ["match_id", "team_id"],
+        )
+        insert_rows(
+            session,
+            MatchObjective.__table__,
+            [row for r in chunk for row in r["objectives"]],
+            ["match_id", "team_id", "objective"],
+        )
+    return inserted
 
 
 def add_match(session, player_id, match_data):
-    existing = (
-        session.query(MatchHistory)
-        .filter_by(player_id=player_id, match_id=match_data["match_id"])
-        .first()
-    )
-
-    if existing:
-        return existing
-
-    match = MatchHistory(
-        player_id=player_id,
-        match_id=match_data["match_id"],
-        game_date=match_data["game_date"],
-        game_duration=match_data["game_duration"],
-        champion_name=match_data["champion_name"],
-        champion_icon_url=match_data["champion_icon_url"],
-        win=match_data["win"],
-        kills=match_data["kills"],
-        deaths=match_data["deaths"],
-        assists=match_data["assists"],
-        kda=match_data["kda"],
-        kill_participation=match_data["kill_participation"],
-        gold_earned=match_data["gold_earned"],
-        gold_per_min=match_data["gold_per_min"],
-        cs=match_data["cs"],
-        cs_per_min=match_data["cs_per_min"],
-        total_damage=match_data["total_damage"],
-        damage_per_min=match_data["damage_per_min"],
-        damage_to_objectives=match_data["damage_to_objectives"],
-        team_damage_pct=match_data["team_damage_pct"],
-        vision_score=match_data["vision_score"],
-        wards_placed=match_data["wards_placed"],
-        control_wards=match_data["control_wards"],
-        items=match_data["items"],
-        summoner_spells=match_data["summoner_spells"],
-        is_anomaly=False,
-        anomaly_reason=None,
-    )
-    session.add(match)
-    return match
+    return add_matches(session, player_id, [match_data])
 
 
 def get_all_players(session):
@@ -109,19 +669,70 @@ def get_player_matches(session, player_id):
     )
 
 
-def cleanup_old_matches(session, player_id):
-    matches = (
-        session.query(MatchHistory)
-        .filter_by(player_id=player_id)
-        .order_by(MatchHistory.game_date.desc())
-        .all()
-    )
+def get_player_match_ids(session, player_id):
+    rows = session.query(MatchHistory.match_id).filter_by(player_id=player_id).all()
+    return {row.match_id for row in rows}
+
+
+def cleanup_old_matches(session, player_id, keep=MATCH_COUNT, max_age_days=None):
+    conditions = []
+
+    if keep is not None:
+        beyond_keep = (
+            select(MatchHistory.id)
+            .where(MatchHistory.player_id == player_id)
+            .order_by(MatchHistory.game_date.desc())
+            .offset(keep)
+        )
+        conditions.append(MatchHistory.id.in_(beyond_keep))
+
+    if max_age_days is not None:
+        cutoff = datetime.now() - timedelta(days=max_age_days)
+        conditions.append(
+            (MatchHistory.player_id == player_id) & (MatchHistory.game_date < cutoff)
+        )
 
-    if len(matches) > MATCH_COUNT:
-        old_matches = matches[MATCH_COUNT:]
-        for match in old_matches:
-            session.delete(match)
+    if not conditions:
+        return 0
+
+    result = session.execute(
+        delete(MatchHistory)
+        .where(or_(*conditions))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
 
 
 def delete_player_matches(session, player_id):
     session.query(MatchHistory).filter_by(player_id=player_id).delete()
+
+
+def last_deletion_id(session):
+    return session.execute(select(func.max(MatchHistoryDeletion.id))).scalar() or 0
+
+
+def prune_deletions(session, last_id):
+    session.execute(
+        delete(MatchHistoryDeletion).where(MatchHistoryDeletion.id <= last_id)
+    )
+
+
+def has_backfill(session, player_id):
+    return session.get(BackfillCursor, player_id) is not None
+
+
+def get_backfill_cursor(session, player_id, start_time):
+    cursor = session.get(BackfillCursor, player_id)
+
+    if cursor is None or cursor.start_time != start_time:
+        if cursor is None:
+            cursor = BackfillCursor(player_id=player_id)
+            session.add(cursor)
+        cursor.start_time = start_time
+        cursor.end_time = datetime.now()
+        cursor.next_start = 0
+        cursor.completed = False
+        cursor.updated_at = datetime.now()
+        session.flush()
+
+    return cursor
@@ -0,0 +1,216 @@
+import os
+import json
+import requests
+
+from config import DDRAGON_BASE, DDRAGON_CACHE_DIR, DDRAGON_LOCALE, DDRAGON_VERSION
+
+
+DATASETS = ["item", "champion", "summoner", "profileicon"]
+VERSIONS_URL = "https://ddragon.leagueoflegends.com/api/versions.json"
+VERSIONS_FILE = "versions.json"
+
+# Used when a dataset is neither cached nor downloadable, so icons still
+# point at the right Data Dragon file names
+FALLBACK_CHAMPION_IDS = {
+    "Kai'Sa": "Kaisa",
+    "Kha'Zix": "Khazix",
+    "Vel'Koz": "Velkoz",
+    "Cho'Gath": "Chogath",
+    "Rek'Sai": "RekSai",
+    "Kog'Maw": "KogMaw",
+    "LeBlanc": "Leblanc",
+    "Wukong": "MonkeyKing",
+    "Nunu & Willump": "Nunu",
+    "Renata Glasc": "Renata",
+}
+
+FALLBACK_SPELL_IDS = {
+    1: "SummonerBoost",
+    3: "SummonerExhaust",
+    4: "SummonerFlash",
+    6: "SummonerHaste",
+    7: "SummonerHeal",
+    11: "SummonerSmite",
+    12: "SummonerTeleport",
+    13: "SummonerMana",
+    14: "SummonerDot",
+    21: "SummonerBarrier",
+    32: "SummonerSnowball",
+}
+
+
+def load_cached_versions(cache_dir=DDRAGON_CACHE_DIR):
+    path = os.path.join(cache_dir, VERSIONS_FILE)
+    if os.path.exists(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    return {}
+
+
+def version_key(version):
+    return [int(part) if part.isdigit() else 0 for part in version.split(".")]
+
+
+def cached_version(cache_dir=DDRAGON_CACHE_DIR):
+    versions = load_cached_versions(cache_dir).get("versions", [])
+    if versions:
+        return versions[0]
+
+    # Fall back to the newest version that has datasets on disk
+    if os.path.isdir(cache_dir):
+        cached = [
+            name
+            for name in os.listdir(cache_dir)
+            if os.path.isdir(os.path.join(cache_dir, name))
+        ]
+        if cached:
+            return max(cached, key=version_key)
+    return DDRAGON_VERSION
+
+
+def latest_version(session, cache_dir=DDRAGON_CACHE_DIR):
+    path = os.path.join(cache_dir, VERSIONS_FILE)
+    cached = load_cached_versions(cache_dir)
+
+    # Revalidated with the stored ETag, so an unchanged list costs a bodyless 304
+    headers = {"If-None-Match": cached["etag"]} if cached.get("etag") else {}
+    versions = cached.get("versions", [])
+    try:
+        response = session.get(VERSIONS_URL, headers=headers, timeout=10)
+        if response.status_code == 200:
+            versions = response.json()
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"etag": response.headers.get("ETag"), "versions": versions}, f
+                )
+            os.replace(tmp_path, path)
+    except (requests.RequestException, ValueError):
+        pass
+
+    return versions[0] if versions else DDRAGON_VERSION
+
+
+class DataDragonCatalog:
+    def __init__(
+        self, version, cache_dir=DDRAGON_CACHE_DIR, locale=DDRAGON_LOCALE, session=None
+    ):
+        self.version = version
+        # Without a session only datasets already on disk are used
+        self.session = session
+        self.cache_dir = cache_dir
+        self.locale = locale
+
+        self.items = {}
+        self.champions = {}
+        self.champions_by_key = {}
+        self.spells = {}
+        self.profile_icons = {}
+
+        self.load()
+
+    def load(self):
+        items = self.load_dataset("item")
+        for item_id, item in items.items():
+            self.items[int(item_id)] = {
+                "name": item.get("name"),
+                "image": item.get("image", {}).get("full", f"{item_id}.png"),
+            }
+
+        champions = self.load_dataset("champion")
+        for champion_id, champion in champions.items():
+            entry = {
+                "id": champion_id,
+                "name": champion.get("name"),
+                "image": champion.get("image", {}).get("full", f"{champion_id}.png"),
+            }
+            self.champions[champion_id] = entry
+            self.champions[champion.get("name")] = entry
+            if champion.get("key"):
+                self.champions_by_key[int(champion["key"])] = entry
+
+        spells = self.load_dataset("summoner")
+        for spell_id, spell in spells.items():
+            if not spell.get("key"):
+                continue
+            self.spells[int(spell["key"])] = {
+                "id": spell_id,
+                "name": spell.get("name"),
+                "image": spell.get("image", {}).get("full", f"{spell_id}.png"),
+            }
+
+        icons = self.load_dataset("profileicon")
+        for icon_id, icon in icons.items():
+            self.profile_icons[int(icon_id)] = icon.get("image", {}).get(
+                "full", f"{icon_id}.png"
+            )
+
+    def load_dataset(self, dataset):
+        path = os.path.join(
+            self.cache_dir, self.version, self.locale, f"{dataset}.json"
+        )
+
+        if os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                pass
+
+        data = self.fetch_dataset(dataset)
+        if data:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        else:
+            print(
+                f"Warning: Data Dragon {dataset} data for {self.version} is "
+                "unavailable, using bundled fallbacks"
+            )
+        return data
+
+    def fetch_dataset(self, dataset):
+        if self.session is None:
+            return {}
+        url = f"{DDRAGON_BASE}/{self.version}/data/{self.locale}/{dataset}.json"
+        try:
+            response = self.session.get(url, timeout=10)
+            if response.status_code == 200:
+                return response.json().get("data", {})
+        except (requests.RequestException, ValueError):
+            pass
+        return {}
+
+    def item_name(self, item_id):
+        item = self.items.get(int(item_id))
+        return item["name"] if item else None
+
+    def item_image(self, item_id):
+        item = self.items.get(int(item_id))
+        return item["image"] if item else f"{item_id}.png"
+
+    def champion_image(self, champion_name, champion_key=None):
+        # The numeric key also covers names the API spells differently
+        # from Data Dragon, such as "FiddleSticks"
+        champion = self.champions_by_key.get(champion_key) or self.champions.get(
+            champion_name
+        )
+        if champion:
+            return champion["image"]
+        return f"{FALLBACK_CHAMPION_IDS.get(champion_name, champion_name)}.png"
+
+    def spell_image(self, spell_id):
+        spell = self.spells.get(spell_id)
+        if spell:
+            return spell["image"]
+        fallback = FALLBACK_SPELL_IDS.get(spell_id)
+        return f"{fallback}.png" if fallback else None
+
+    def profile_icon_image(self, icon_id):
+        return self.profile_icons.get(icon_id, f"{icon_id}.png")
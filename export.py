@@ -1,137 +1,483 @@
 import os
+import sys
+import glob
 import json
+import time
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
 import pandas as pd
+from sqlalchemy import func, select
 
-from database import get_session, get_all_players, get_player_matches
-from models import MatchHistory
-from analysis import calculate_player_summary, generate_insights
+from database import (
+    get_session,
+    last_deletion_id,
+    prune_deletions,
+    match_history_slots,
+)
+from models import Player, MatchHistory, MatchHistoryDeletion
+from analysis import (
+    calculate_player_summary,
+    calculate_champion_stats,
+    summarize_frame,
+    generate_insights,
+)
+from metrics import METRICS
+from config import (
+    EXPORT_FORMATS,
+    EXPORT_INCREMENTAL,
+    EXPORT_MAX_PARTITIONS,
+    PARQUET_COMPRESSION,
+    ARROW_COMPRESSION,
+)
 
 
 OUTPUT_DIR = "tableau_data"
+STATE_FILE = f"{OUTPUT_DIR}/_export_state.json"
+
+MATCH_HISTORY_COLUMNS = [
+    "name",
+    "profile_icon_url",
+    "match_id",
+    "game_date",
+    "game_duration",
+    "champion_name",
+    "champion_icon_url",
+    "win",
+    "kills",
+    "deaths",
+    "assists",
+    "kda",
+    "kill_participation",
+    "gold_earned",
+    "gold_per_min",
+    "cs",
+    "cs_per_min",
+    "total_damage",
+    "damage_per_min",
+    "damage_to_objectives",
+    "team_damage_pct",
+    "vision_score",
+    "wards_placed",
+    "control_wards",
+    "items",
+    "summoner_spells",
+    "is_anomaly",
+    "anomaly_reason",
+]
+
+DATASETS = [
+    "player_summary",
+    "match_history",
+    "champion_stats",
+    "anomalies",
+    "player_insights",
+]
+
+DELETED_COLUMNS = ["name", "match_id", "deleted_at"]
+
+ANOMALY_COLUMNS = [
+    "name",
+    "profile_icon_url",
+    "game_date",
+    "champion_name",
+    "champion_icon_url",
+    "win",
+    "kda",
+    "kills",
+    "deaths",
+    "assists",
+    "anomaly_reason",
+]
 
 
-def export_player_summary():
+def load_export_frame(*conditions):
+    match_columns = [
+        column
+        for column in MatchHistory.__table__.columns
+        if column.name not in ("id", "items", "summoner_spells")
+    ]
+    stmt = (
+        select(
+            Player.name,
+            Player.tag_line,
+            Player.level,
+            Player.profile_icon_url,
+            MatchHistory.id.label("match_row_id"),
+            *match_columns,
+            match_history_slots.c["items"],
+            match_history_slots.c["summoner_spells"],
+        )
+        .join(MatchHistory, MatchHistory.player_id == Player.id)
+        .join(
+            match_history_slots,
+            match_history_slots.c.match_history_id == MatchHistory.id,
+        )
+        .where(*conditions)
+        .order_by(Player.id, MatchHistory.game_date.desc())
+    )
+
     with get_session() as session:
-        df = calculate_player_summary(session)
-    return df
+        frame = pd.read_sql(stmt, session.connection())
+
+    frame["game_date"] = pd.to_datetime(frame["game_date"])
+    for column in ("win", "is_anomaly"):
+        frame[column] = frame[column].astype(bool)
+    return frame
+
+
+def export_player_summary(frame=None):
+    if frame is None:
+        frame = load_export_frame()
+    return summarize_frame(frame)
+
 
+def export_match_history(frame=None):
+    if frame is None:
+        frame = load_export_frame()
+    return frame[MATCH_HISTORY_COLUMNS].reset_index(drop=True)
 
-def export_match_history():
-    rows = []
 
+def export_anomalies(frame=None):
+    if frame is None:
+        frame = load_export_frame()
+    return frame.loc[frame["is_anomaly"], ANOMALY_COLUMNS].reset_index(drop=True)
+
+
+def export_champion_stats():
     with get_session() as session:
-        players = get_all_players(session)
-
-        for player in players:
-            matches = get_player_matches(session, player.id)
-
-            for match in matches:
-                rows.append(
-                    {
-                        "name": player.name,
-                        "profile_icon_url": player.profile_icon_url,
-                        "match_id": match.match_id,
-                        "game_date": match.game_date,
-                        "game_duration": match.game_duration,
-                        "champion_name": match.champion_name,
-                        "champion_icon_url": match.champion_icon_url,
-                        "win": match.win,
-                        "kills": match.kills,
-                        "deaths": match.deaths,
-                        "assists": match.assists,
-                        "kda": match.kda,
-                        "kill_participation": match.kill_participation,
-                        "gold_earned": match.gold_earned,
-                        "gold_per_min": match.gold_per_min,
-                        "cs": match.cs,
-                        "cs_per_min": match.cs_per_min,
-                        "total_damage": match.total_damage,
-                        "damage_per_min": match.damage_per_min,
-                        "damage_to_objectives": match.damage_to_objectives,
-                        "team_damage_pct": match.team_damage_pct,
-                        "vision_score": match.vision_score,
-                        "wards_placed": match.wards_placed,
-                        "control_wards": match.control_wards,
-                        "items": json.dumps(match.items) if match.items else "[]",
-                        "summoner_spells": json.dumps(match.summoner_spells)
-                        if match.summoner_spells
-                        else "[]",
-                        "is_anomaly": match.is_anomaly,
-                        "anomaly_reason": match.anomaly_reason,
-                    }
-                )
-
-    return pd.DataFrame(rows)
-
-
-def export_anomalies():
-    rows = []
+        return calculate_champion_stats(session)
+
+
+def export_insights(frame=None, player_summary=None):
+    if player_summary is None:
+        player_summary = export_player_summary(frame)
+    return generate_insights(player_summary)
+
+
+CATEGORY_COLUMNS = [
+    "name",
+    "tag_line",
+    "profile_icon_url",
+    "champion_name",
+    "champion_icon_url",
+]
+
+
+def slot_types():
+    import pyarrow as pa
+
+    return {
+        "items": pa.list_(
+            pa.struct(
+                [("id", pa.int64()), ("name", pa.string()), ("icon_url", pa.string())]
+            )
+        ),
+        "summoner_spells": pa.list_(
+            pa.struct([("id", pa.int64()), ("icon_url", pa.string())])
+        ),
+    }
+
+
+def columnar_table(df):
+    import pyarrow as pa
+
+    df = df.reset_index(drop=True)
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+
+    # Columnar files get typed list<struct> slots instead of the JSON text CSV
+    # needs, so readers can unnest them without parsing. They are added to the
+    # Arrow table directly so no pandas dtype is recorded for them.
+    slots = {
+        column: pa.array(
+            [json.loads(value) if value else [] for value in df[column]],
+            type=slot_type,
+        )
+        for column, slot_type in slot_types().items()
+        if column in df.columns
+    }
+    table = pa.Table.from_pandas(df.drop(columns=list(slots)), preserve_index=False)
+    for column, values in slots.items():
+        table = table.add_column(df.columns.get_loc(column), column, values)
+    return table
+
+
+def write_csv(df, path):
+    df.to_csv(f"{path}.csv", index=False)
+    return f"{path}.csv"
+
+
+def write_parquet(df, path):
+    import pyarrow.parquet as pq
+
+    pq.write_table(
+        columnar_table(df), f"{path}.parquet", compression=PARQUET_COMPRESSION
+    )
+    return f"{path}.parquet"
+
+
+def write_arrow(df, path):
+    import pyarrow.feather as feather
+
+    feather.write_feather(
+        columnar_table(df), f"{path}.arrow", compression=ARROW_COMPRESSION
+    )
+    return f"{path}.arrow"
+
+
+WRITERS = {
+    "csv": write_csv,
+    "parquet": write_parquet,
+    "arrow": write_arrow,
+}
+
+PYARROW_FORMATS = ["parquet", "arrow"]
+
+
+def write_dataset(name, df, fmt):
+    start = time.perf_counter()
+    path = WRITERS[fmt](df, f"{OUTPUT_DIR}/{name}")
+    elapsed = time.perf_counter() - start
+
+    # Partitions are labelled with their dataset to keep label values bounded
+    dataset = name.split(".")[0]
+    METRICS.observe("export_file", elapsed, dataset=dataset, format=fmt)
+    METRICS.rows("export_rows", len(df), dataset=dataset, format=fmt)
+    return path, len(df), elapsed
 
+
+def load_export_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_export_state(state):
+    with open(STATE_FILE, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+
+
+def remove_partitions(name):
+    for path in glob.glob(f"{OUTPUT_DIR}/{name}.part-*"):
+        os.remove(path)
+
+
+def latest_update(frame):
+    updated_at = pd.to_datetime(frame["updated_at"]).max()
+    if pd.isna(updated_at):
+        return datetime.min.isoformat(sep=" ")
+    return updated_at.isoformat(sep=" ")
+
+
+def exported_state(frame, partitions=0, deleted_id=0):
+    return {
+        "watermark": latest_update(frame),
+        "max_id": int(frame["match_row_id"].max()) if not frame.empty else 0,
+        "rows": len(frame),
+        "partitions": partitions,
+        "deleted_id": deleted_id,
+    }
+
+
+def load_deleted_frame(exported, last_id):
+    # Rows deleted before they were ever exported need no tombstone
+    stmt = (
+        select(
+            Player.name,
+            MatchHistoryDeletion.match_id,
+            MatchHistoryDeletion.deleted_at,
+        )
+        .outerjoin(Player, Player.id == MatchHistoryDeletion.player_id)
+        .where(
+            MatchHistoryDeletion.id > exported["deleted_id"],
+            MatchHistoryDeletion.id <= last_id,
+            MatchHistoryDeletion.match_history_id <= exported["max_id"],
+        )
+        .order_by(MatchHistoryDeletion.id)
+    )
     with get_session() as session:
-        players = get_all_players(session)
-
-        for player in players:
-            matches = get_player_matches(session, player.id)
-
-            for match in matches:
-                if match.is_anomaly:
-                    rows.append(
-                        {
-                            "name": player.name,
-                            "profile_icon_url": player.profile_icon_url,
-                            "game_date": match.game_date,
-                            "champion_name": match.champion_name,
-                            "champion_icon_url": match.champion_icon_url,
-                            "win": match.win,
-                            "kda": match.kda,
-                            "kills": match.kills,
-                            "deaths": match.deaths,
-                            "assists": match.assists,
-                            "anomaly_reason": match.anomaly_reason,
-                        }
-                    )
-
-    return pd.DataFrame(rows)
-
-
-def export_insights():
+        frame = pd.read_sql(stmt, session.connection())
+    frame["deleted_at"] = pd.to_datetime(frame["deleted_at"])
+    return frame[DELETED_COLUMNS]
+
+
+def exported_rows_changed(exported, deleted):
+    # Partitions only hold rows that were never exported, so an update among
+    # exported rows, or a delete without a tombstone, needs a full rewrite
+    watermark = datetime.fromisoformat(exported["watermark"])
+    with get_session() as session:
+        rows, updated = session.execute(
+            select(
+                func.count(MatchHistory.id),
+                func.count(MatchHistory.id).filter(MatchHistory.updated_at > watermark),
+            ).where(MatchHistory.id <= exported["max_id"])
+        ).one()
+
+    untracked = exported["rows"] - deleted - rows
+    if untracked:
+        return f"{untracked} exported match rows deleted without a tombstone"
+    if updated:
+        return f"{updated} exported match rows updated"
+    return None
+
+
+def full_datasets(state, names=DATASETS):
+    if "match_history" in names:
+        # Read first, so rows deleted while the frame loads keep their tombstone
+        with get_session() as session:
+            deleted_id = last_deletion_id(session)
+
+    frame = load_export_frame()
+    player_summary = export_player_summary(frame)
+
+    if "match_history" in names:
+        remove_partitions("match_history")
+        remove_partitions("match_history_deleted")
+        state["match_history"] = exported_state(frame, deleted_id=deleted_id)
+        with get_session() as session:
+            prune_deletions(session, deleted_id)
+
+    builders = {
+        "player_summary": lambda: player_summary,
+        "match_history": lambda: export_match_history(frame),
+        "champion_stats": export_champion_stats,
+        "anomalies": lambda: export_anomalies(frame),
+        "player_insights": lambda: export_insights(player_summary=player_summary),
+    }
+    return {name: builders[name]() for name in names}
+
+
+def incremental_datasets(state, names=DATASETS):
     with get_session() as session:
         player_summary = calculate_player_summary(session)
-    return generate_insights(player_summary)
 
+    builders = {
+        "player_summary": lambda: player_summary,
+        "champion_stats": export_champion_stats,
+        "anomalies": lambda: export_anomalies(
+            load_export_frame(MatchHistory.is_anomaly == True)
+        ),
+        "player_insights": lambda: export_insights(player_summary=player_summary),
+    }
+    datasets = {name: builders[name]() for name in names if name in builders}
+
+    if "match_history" in names:
+        exported = state["match_history"]
+        with get_session() as session:
+            last_id = last_deletion_id(session)
+        deleted = load_deleted_frame(exported, last_id)
+
+        reason = exported_rows_changed(exported, len(deleted))
+        if reason:
+            print(f"  {reason}, rewriting match_history")
+            datasets.update(full_datasets(state, ["match_history"]))
+            return datasets
+
+        added = load_export_frame(MatchHistory.id > exported["max_id"])
+        print(f"  {len(added)} match rows added since the last export")
+        print(f"  {len(deleted)} exported match rows deleted since the last export")
+
+        partition = exported["partitions"]
+        if not added.empty or not deleted.empty:
+            partition += 1
+        if not added.empty:
+            datasets[f"match_history.part-{partition:05d}"] = export_match_history(
+                added
+            )
+        if not deleted.empty:
+            datasets[f"match_history_deleted.part-{partition:05d}"] = deleted
+
+        if not added.empty:
+            appended = exported_state(added)
+            exported = {
+                **exported,
+                "max_id": appended["max_id"],
+                "watermark": max(
+                    exported["watermark"],
+                    appended["watermark"],
+                    key=datetime.fromisoformat,
+                ),
+                "rows": exported["rows"] + appended["rows"],
+            }
+        state["match_history"] = {
+            **exported,
+            "rows": exported["rows"] - len(deleted),
+            "partitions": partition,
+            "deleted_id": last_id,
+        }
 
-def run_export():
+    return datasets
+
+
+def can_export_incrementally(state, formats):
+    if state.get("formats") != list(formats) or "deleted_id" not in state.get(
+        "match_history", {}
+    ):
+        return False
+    if state["match_history"]["partitions"] >= EXPORT_MAX_PARTITIONS:
+        print(f"  {EXPORT_MAX_PARTITIONS} partitions reached, compacting")
+        return False
+    return all(os.path.exists(f"{OUTPUT_DIR}/match_history.{fmt}") for fmt in formats)
+
+
+def run_export(formats=EXPORT_FORMATS, incremental=EXPORT_INCREMENTAL, datasets=None):
     print("=" * 50)
-    print("EXPORT TO CSV")
+    print(f"EXPORT TO {', '.join(fmt.upper() for fmt in formats)}")
     print("=" * 50)
 
+    unknown = [fmt for fmt in formats if fmt not in WRITERS]
+    if unknown:
+        raise ValueError(f"Unknown export format(s): {', '.join(unknown)}")
+
+    columnar = [fmt for fmt in formats if fmt in PYARROW_FORMATS]
+    if columnar and importlib.util.find_spec("pyarrow") is None:
+        raise ImportError(
+            f"{', '.join(columnar)} export needs pyarrow: "
+            "install it with `uv sync --extra columnar`"
+        )
+
+    names = DATASETS if datasets is None else [n for n in DATASETS if n in datasets]
+
     if not os.path.exists(OUTPUT_DIR):
         os.makedirs(OUTPUT_DIR)
 
-    print("Exporting player summary...")
-    player_summary = export_player_summary()
-    player_summary.to_csv(f"{OUTPUT_DIR}/player_summary.csv", index=False)
-    print(f"  Saved {len(player_summary)} rows")
+    start = time.perf_counter()
+    state = load_export_state()
+    print("Loading matches...")
+    if incremental and can_export_incrementally(state, formats):
+        with METRICS.timer("export_load", mode="incremental"):
+            datasets = incremental_datasets(state, names)
+    else:
+        with METRICS.timer("export_load", mode="full"):
+            datasets = full_datasets(state, names)
+    state["formats"] = list(formats)
+    print(f"  Loaded data in {time.perf_counter() - start:.2f}s")
 
-    print("Exporting match history...")
-    match_history = export_match_history()
-    match_history.to_csv(f"{OUTPUT_DIR}/match_history.csv", index=False)
-    print(f"  Saved {len(match_history)} rows")
+    print("Writing files...")
+    jobs = [(name, df, fmt) for name, df in datasets.items() for fmt in formats]
+    with ThreadPoolExecutor(max_workers=max(len(jobs), 1)) as pool:
+        results = list(pool.map(lambda job: write_dataset(*job), jobs))
 
-    print("Exporting anomalies...")
-    anomalies = export_anomalies()
-    anomalies.to_csv(f"{OUTPUT_DIR}/anomalies.csv", index=False)
-    print(f"  Saved {len(anomalies)} rows")
+    for path, rows, elapsed in results:
+        print(f"  {os.path.basename(path)}: saved {rows} rows in {elapsed:.2f}s")
 
-    print("Exporting insights...")
-    insights = export_insights()
-    insights.to_csv(f"{OUTPUT_DIR}/player_insights.csv", index=False)
-    print(f"  Saved {len(insights)} rows")
+    save_export_state(state)
 
     print()
-    print(f"All files saved to {OUTPUT_DIR}/")
+    print(f"All files saved to {OUTPUT_DIR}/ in {time.perf_counter() - start:.2f}s")
     print("Export complete!")
 
 
+def compact_exports(formats=EXPORT_FORMATS):
+    run_export(formats, incremental=False)
+
+
 if __name__ == "__main__":
-    run_export()
+    if "--compact" in sys.argv:
+        compact_exports()
+    else:
+        run_export()
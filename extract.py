@@ -1,31 +1,40 @@
-import time
-from datetime import datetime
+import sys
+import queue
+import itertools
+import threading
+from datetime import datetime, timedelta
 
-from api_client import ApiClient
+from api_client import ApiClient, StaticDataClient
 from database import (
     get_session,
     init_db,
     get_or_create_player,
-    add_match,
+    add_matches,
+    add_match_records,
     cleanup_old_matches,
     delete_player_matches,
+    get_player_match_ids,
+    get_all_players,
+    get_backfill_cursor,
+    has_backfill,
 )
-from config import PLAYERS
-
-
-def extract_match_data(client, match, puuid):
-    info = match["info"]
-    metadata = match["metadata"]
-
-    participant = None
-    for p in info["participants"]:
-        if p["puuid"] == puuid:
-            participant = p
-            break
+from raw_store import RawMatchStore
+from config import (
+    PLAYERS,
+    FETCH_WORKERS,
+    PARSE_WORKERS,
+    PIPELINE_QUEUE_SIZE,
+    WRITE_BATCH_SIZE,
+    INCREMENTAL_EXTRACTION,
+    MATCH_COUNT,
+    RETENTION_DAYS,
+    BACKFILL_SINCE,
+    BACKFILL_PAGE_SIZE,
+)
+from metrics import METRICS
 
-    if not participant:
-        return None
 
+def participant_stats(info, participant):
     game_duration = info.get("gameDuration", 1)
     duration_min = game_duration / 60 if game_duration > 0 else 1
 
@@ -42,6 +51,45 @@ def extract_match_data(client, match, puuid):
         "neutralMinionsKilled", 0
     )
 
+    return {
+        "champion_name": participant.get("championName", "Unknown"),
+        "win": participant.get("win", False),
+        "kills": kills,
+        "deaths": deaths,
+        "assists": assists,
+        "kda": round(kda, 2),
+        "kill_participation": round(kill_participation, 2),
+        "gold_earned": participant.get("goldEarned", 0),
+        "gold_per_min": round(participant.get("goldEarned", 0) / duration_min, 1),
+        "cs": cs,
+        "cs_per_min": round(cs / duration_min, 1),
+        "total_damage": participant.get("totalDamageDealtToChampions", 0),
+        "damage_per_min": round(
+            participant.get("totalDamageDealtToChampions", 0) / duration_min, 1
+        ),
+        "damage_to_objectives": participant.get("damageDealtToObjectives", 0),
+        "team_damage_pct": round(team_damage_pct, 2),
+        "vision_score": participant.get("visionScore", 0),
+        "wards_placed": participant.get("wardsPlaced", 0),
+        "control_wards": participant.get("detectorWardsPlaced", 0),
+    }
+
+
+def extract_match_data(client, match, puuid):
+    info = match["info"]
+    metadata = match["metadata"]
+
+    participant = None
+    for p in info["participants"]:
+        if p["puuid"] == puuid:
+            participant = p
+            break
+
+    if not participant:
+        return None
+
+    stats = participant_stats(info, participant)
+
     items = []
     for i in range(7):
         item_id = participant.get(f"item{i}", 0)
@@ -61,39 +109,102 @@ def extract_match_data(client, match, puuid):
         {"id": spell2_id, "icon_url": client.get_spell_icon_url(spell2_id)},
     ]
 
-    champion_name = participant.get("championName", "Unknown")
-
     return {
         "match_id": metadata.get("matchId"),
+        "ddragon_version": client.version,
         "game_date": datetime.fromtimestamp(info.get("gameCreation", 0) / 1000),
-        "game_duration": game_duration,
-        "champion_name": champion_name,
-        "champion_icon_url": client.get_champion_icon_url(champion_name),
-        "win": participant.get("win", False),
-        "kills": kills,
-        "deaths": deaths,
-        "assists": assists,
-        "kda": round(kda, 2),
-        "kill_participation": round(kill_participation, 2),
-        "gold_earned": participant.get("goldEarned", 0),
-        "gold_per_min": round(participant.get("goldEarned", 0) / duration_min, 1),
-        "cs": cs,
-        "cs_per_min": round(cs / duration_min, 1),
-        "total_damage": participant.get("totalDamageDealtToChampions", 0),
-        "damage_per_min": round(
-            participant.get("totalDamageDealtToChampions", 0) / duration_min, 1
+        "game_duration": info.get("gameDuration", 1),
+        "champion_icon_url": client.get_champion_icon_url(
+            stats["champion_name"], participant.get("championId")
         ),
-        "damage_to_objectives": participant.get("damageDealtToObjectives", 0),
-        "team_damage_pct": round(team_damage_pct, 2),
-        "vision_score": participant.get("visionScore", 0),
-        "wards_placed": participant.get("wardsPlaced", 0),
-        "control_wards": participant.get("detectorWardsPlaced", 0),
+        **stats,
         "items": items,
         "summoner_spells": summoner_spells,
     }
 
 
-def extract_player(client, session, name, tag):
+def extract_match_records(match):
+    info = match["info"]
+    match_id = match["metadata"].get("matchId")
+
+    participants = []
+    for participant in info["participants"]:
+        participants.append(
+            {
+                "match_id": match_id,
+                "participant_id": participant.get("participantId"),
+                "puuid": participant.get("puuid"),
+                "riot_id_name": participant.get("riotIdGameName"),
+                "riot_id_tagline": participant.get("riotIdTagline"),
+                "team_id": participant.get("teamId"),
+                "team_position": participant.get("teamPosition"),
+                "champion_id": participant.get("championId"),
+                "champion_level": participant.get("champLevel"),
+                **participant_stats(info, participant),
+            }
+        )
+
+    teams = []
+    objectives = []
+    for team in info.get("teams", []):
+        teams.append(
+            {
+                "match_id": match_id,
+                "team_id": team.get("teamId"),
+                "win": team.get("win", False),
+                "bans": [ban.get("championId") for ban in team.get("bans", [])],
+            }
+        )
+        for objective, values in team.get("objectives", {}).items():
+            objectives.append(
+                {
+                    "match_id": match_id,
+                    "team_id": team.get("teamId"),
+                    "objective": objective,
+                    "first": values.get("first", False),
+                    "kills": values.get("kills", 0),
+                }
+            )
+
+    return {
+        "match": {
+            "match_id": match_id,
+            "game_date": datetime.fromtimestamp(info.get("gameCreation", 0) / 1000),
+            "game_duration": info.get("gameDuration", 1),
+            "game_mode": info.get("gameMode"),
+            "queue_id": info.get("queueId"),
+            "map_id": info.get("mapId"),
+            "game_version": info.get("gameVersion"),
+        },
+        "participants": participants,
+        "teams": teams,
+        "objectives": objectives,
+    }
+
+
+def extract_tracked_rows(client, match, tracked, rows):
+    for puuid in match["metadata"].get("participants", []):
+        player_id = tracked.get(puuid)
+        if player_id is None:
+            continue
+        match_data = extract_match_data(client, match, puuid)
+        if match_data:
+            rows[player_id].append(match_data)
+
+
+def player_retention(name, backfilled=False):
+    # Backfilled history is kept in full unless a player sets "retention"
+    default_keep = None if backfilled else MATCH_COUNT
+    for player_config in PLAYERS:
+        if player_config["name"] == name:
+            return (
+                player_config.get("retention", default_keep),
+                player_config.get("retention_days", RETENTION_DAYS),
+            )
+    return default_keep, RETENTION_DAYS
+
+
+def resolve_player(client, session, name, tag):
     print(f"  Fetching account for {name}#{tag}...")
     account = client.get_account(name, tag)
     puuid = account["puuid"]
@@ -105,32 +216,162 @@ def extract_player(client, session, name, tag):
     profile_icon_url = client.get_profile_icon_url(icon_id)
 
     player = get_or_create_player(session, puuid, name, tag, level, profile_icon_url)
+    return player, puuid
+
+
+def match_list_window(retention):
+    keep, max_age_days = retention
+    count = MATCH_COUNT if keep is None else min(keep, MATCH_COUNT)
+    start_time = None
+    if max_age_days is not None:
+        start_time = int((datetime.now() - timedelta(days=max_age_days)).timestamp())
+    return count, start_time
+
 
-    delete_player_matches(session, player.id)
+def extract_player(client, session, name, tag, incremental=INCREMENTAL_EXTRACTION):
+    player, puuid = resolve_player(client, session, name, tag)
+    retention = player_retention(name, has_backfill(session, player.id))
 
+    if not incremental:
+        delete_player_matches(session, player.id)
+
+    # Matches past retention would only be inserted and trimmed again
+    count, start_time = match_list_window(retention)
     print(f"  Fetching match history...")
-    match_ids = client.get_match_ids(puuid)
+    match_ids = client.get_match_ids(puuid, count=count, start_time=start_time)
     print(f"  Found {len(match_ids)} matches")
 
-    for i, match_id in enumerate(match_ids):
-        try:
-            print(f"    [{i + 1}/{len(match_ids)}] {match_id}")
-            match = client.get_match(match_id)
-            match_data = extract_match_data(client, match, puuid)
+    if incremental:
+        stored = get_player_match_ids(session, player.id)
+        match_ids = [match_id for match_id in match_ids if match_id not in stored]
+        print(f"  {len(match_ids)} new since last run")
+
+    return {
+        "player": player,
+        "puuid": puuid,
+        "name": name,
+        "match_ids": match_ids,
+        "retention": retention,
+    }
 
-            if match_data:
-                add_match(session, player.id, match_data)
 
-            time.sleep(0.5)
+STOP = object()
+
+
+class BatchWriter:
+    def __init__(self, session, player_ids, batch_size=WRITE_BATCH_SIZE):
+        self.session = session
+        self.batch_size = batch_size
+        self.records = []
+        self.rows = {player_id: [] for player_id in player_ids}
+        self.inserted = {player_id: 0 for player_id in player_ids}
+        self.skipped = {player_id: 0 for player_id in player_ids}
+        self.new_matches = 0
+
+    def add(self, records, rows):
+        self.records.append(records)
+        for player_id, player_rows in rows.items():
+            self.rows[player_id].extend(player_rows)
+        if len(self.records) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        with METRICS.timer("db_write", writer="batch"):
+            new_matches = add_match_records(self.session, self.records)
+            self.new_matches += new_matches
+            METRICS.rows("rows_written", new_matches, table="matches")
+            for player_id, player_rows in self.rows.items():
+                inserted, skipped = add_matches(self.session, player_id, player_rows)
+                self.inserted[player_id] += inserted
+                self.skipped[player_id] += skipped
+                METRICS.rows("rows_written", inserted, table="match_history")
+                player_rows.clear()
+            self.records = []
+            self.session.commit()
+
+
+def fetch_worker(client, pending, raw_queue, progress, total, failed):
+    while True:
+        try:
+            match_id = pending.get_nowait()
+        except queue.Empty:
+            return
+        print(f"    [{next(progress)}/{total}] {match_id}")
+        try:
+            raw_queue.put(client.get_match(match_id))
         except Exception as e:
+            METRICS.count("fetch_errors")
+            failed.append(match_id)
             print(f"    Error: {e}")
-            continue
 
-    cleanup_old_matches(session, player.id)
-    print(f"  Done with {name}")
+
+def parse_worker(client, tracked, raw_queue, parsed_queue, failed):
+    while True:
+        match = raw_queue.get()
+        if match is STOP:
+            return
+        try:
+            with METRICS.timer("parse_match"):
+                rows = {player_id: [] for player_id in tracked.values()}
+                extract_tracked_rows(client, match, tracked, rows)
+                records = extract_match_records(match)
+            parsed_queue.put((records, rows))
+        except Exception as e:
+            METRICS.count("parse_errors")
+            failed.append(match.get("metadata", {}).get("matchId"))
+            print(f"    Parse error: {e}")
+
+
+def close_after(threads, target, count):
+    for thread in threads:
+        thread.join()
+    for _ in range(count):
+        target.put(STOP)
 
 
-def run_extraction():
+def start_threads(target, args, count):
+    threads = [
+        threading.Thread(target=target, args=args, daemon=True) for _ in range(count)
+    ]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def stream_matches(client, jobs, tracked, writer):
+    match_ids = list(dict.fromkeys(m for job in jobs for m in job["match_ids"]))
+    pending = queue.Queue()
+    for match_id in match_ids:
+        pending.put(match_id)
+
+    raw_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    parsed_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    progress = itertools.count(1)
+    failed = []
+
+    fetchers = start_threads(
+        fetch_worker,
+        (client, pending, raw_queue, progress, len(match_ids), failed),
+        FETCH_WORKERS,
+    )
+    parsers = start_threads(
+        parse_worker,
+        (client, tracked, raw_queue, parsed_queue, failed),
+        PARSE_WORKERS,
+    )
+    start_threads(close_after, (fetchers, raw_queue, PARSE_WORKERS), 1)
+    start_threads(close_after, (parsers, parsed_queue, 1), 1)
+
+    while True:
+        item = parsed_queue.get()
+        if item is STOP:
+            break
+        writer.add(*item)
+    writer.flush()
+    return set(failed)
+
+
+def run_extraction(incremental=INCREMENTAL_EXTRACTION):
     print("=" * 50)
     print("DATA EXTRACTION")
     print("=" * 50)
@@ -142,21 +383,177 @@ def run_extraction():
     print()
 
     with get_session() as session:
+        jobs = []
         for player_config in PLAYERS:
             name = player_config["name"]
             tag = player_config["tag"]
 
             print(f"Processing {name}#{tag}")
             try:
-                extract_player(client, session, name, tag)
+                jobs.append(extract_player(client, session, name, tag, incremental))
+                session.commit()
             except Exception as e:
+                session.rollback()
                 print(f"  Failed: {e}")
 
             print()
-            time.sleep(1)
+
+        print(
+            f"Fetching matches with {FETCH_WORKERS} fetch "
+            f"and {PARSE_WORKERS} parse workers..."
+        )
+        tracked = {job["puuid"]: job["player"].id for job in jobs}
+        writer = BatchWriter(session, tracked.values())
+        failed = stream_matches(client, jobs, tracked, writer)
+        print(f"  Stored {writer.new_matches} new matches with all participants")
+        if failed:
+            print(f"  {len(failed)} matches failed and will be retried next run")
+
+        for job in jobs:
+            player_id = job["player"].id
+            cleanup_old_matches(session, player_id, *job["retention"])
+            session.commit()
+            print(
+                f"  Done with {job['name']}: {writer.inserted[player_id]} inserted, "
+                f"{writer.skipped[player_id]} skipped"
+            )
+
+        if client.scheduler.throttled:
+            print(f"Rate limited {client.scheduler.throttled} times")
+        if client.transport:
+            print(client.transport.summary())
 
     print("Extraction complete!")
+    return client.version
+
+
+def backfill_player(client, session, player, puuid, start_time):
+    cursor = get_backfill_cursor(session, player.id, start_time)
+    session.commit()
+
+    if cursor.completed:
+        print(f"  Backfill since {start_time:%Y-%m-%d} already complete")
+        return
+
+    stored = get_player_match_ids(session, player.id)
+    tracked = {p.puuid: p.id for p in get_all_players(session)}
+    writer = BatchWriter(session, tracked.values())
+
+    while not cursor.completed:
+        print(f"  Page starting at {cursor.next_start}...")
+        match_ids = client.get_match_ids(
+            puuid,
+            start=cursor.next_start,
+            count=BACKFILL_PAGE_SIZE,
+            start_time=int(cursor.start_time.timestamp()),
+            end_time=int(cursor.end_time.timestamp()),
+        )
+        new_ids = [match_id for match_id in match_ids if match_id not in stored]
+        job = {"player": player, "puuid": puuid, "match_ids": new_ids}
+        failed = stream_matches(client, [job], tracked, writer)
+        stored.update(match_id for match_id in new_ids if match_id not in failed)
+
+        # The cursor only moves past fully stored pages, so a resumed
+        # backfill retries this one instead of skipping its failures
+        if failed:
+            print(
+                f"  {len(failed)} matches failed, stopping; "
+                "the page is retried on the next run"
+            )
+            break
+
+        cursor.next_start += len(match_ids)
+        cursor.completed = len(match_ids) < BACKFILL_PAGE_SIZE
+        cursor.updated_at = datetime.now()
+        session.commit()
+
+    print(f"  {writer.new_matches} new matches stored")
+
+
+def run_backfill(since=BACKFILL_SINCE):
+    print("=" * 50)
+    print("HISTORY BACKFILL")
+    print("=" * 50)
+
+    init_db()
+    client = ApiClient()
+    start_time = datetime.fromisoformat(since)
+
+    with get_session() as session:
+        resolved = []
+        for player_config in PLAYERS:
+            name = player_config["name"]
+            tag = player_config["tag"]
+            print(f"Resolving {name}#{tag}")
+            try:
+                resolved.append(resolve_player(client, session, name, tag))
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                print(f"  Failed: {e}")
+        print()
+
+        for player, puuid in resolved:
+            print(f"Backfilling {player.name}#{player.tag_line}")
+            keep, max_age_days = player_retention(player.name, backfilled=True)
+            if keep is not None:
+                print(f"  Warning: retention keeps only the newest {keep} matches")
+            if max_age_days is not None:
+                print(f"  Warning: matches older than {max_age_days} days are dropped")
+            try:
+                backfill_player(client, session, player, puuid, start_time)
+                removed = cleanup_old_matches(session, player.id, keep, max_age_days)
+                session.commit()
+                if removed:
+                    print(f"  Trimmed {removed} matches past retention")
+            except Exception as e:
+                session.rollback()
+                print(f"  Failed: {e}")
+            print()
+
+    print("Backfill complete!")
+
+
+def rebuild_from_raw():
+    print("=" * 50)
+    print("REBUILD FROM RAW MATCHES")
+    print("=" * 50)
+
+    init_db()
+    # Parsing only needs Data Dragon, so the rebuild runs without an API key
+    # or network from the disk cache
+    client = StaticDataClient()
+    raw_store = RawMatchStore()
+    print(f"Using cached Data Dragon version: {client.version}")
+    print(f"Raw store has {len(raw_store)} matches")
+
+    with get_session() as session:
+        players = {player.puuid: player for player in get_all_players(session)}
+        for player in players.values():
+            delete_player_matches(session, player.id)
+
+        tracked = {puuid: player.id for puuid, player in players.items()}
+        writer = BatchWriter(session, tracked.values())
+        for match_id, match in raw_store.iter_matches():
+            rows = {player_id: [] for player_id in tracked.values()}
+            extract_tracked_rows(client, match, tracked, rows)
+            writer.add(extract_match_records(match), rows)
+        writer.flush()
+
+        for player in players.values():
+            retention = player_retention(player.name, has_backfill(session, player.id))
+            cleanup_old_matches(session, player.id, *retention)
+        session.commit()
+        rebuilt = sum(writer.inserted.values())
+
+    print(f"Rebuilt {rebuilt} match rows")
+    print("Rebuild complete!")
 
 
 if __name__ == "__main__":
-    run_extraction()
+    if "--rebuild" in sys.argv:
+        rebuild_from_raw()
+    elif "--backfill" in sys.argv:
+        run_backfill()
+    else:
+        run_extraction()
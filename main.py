@@ -1,35 +1,205 @@
+import os
+import sys
+import json
+import time
+import hashlib
+
+from sqlalchemy import inspect, text
+
+import config
+import database
+from database import init_db
 from extract import run_extraction
 from analysis import run_analysis
-from export import run_export
+from export import run_export, OUTPUT_DIR
+from metrics import METRICS, profiled
+from config import EXPORT_FORMATS, PIPELINE_STATE_FILE
+
+
+# Small tables whose rows change in place, so their contents are hashed.
+# players.updated_at is refreshed on every extraction and left out.
+CONTENT_TABLES = ["players", "champion_stats"]
+
+MATCH_EXPORT_TABLES = [
+    "players",
+    "match_history",
+    "match_items",
+    "match_spells",
+    "items",
+    "summoner_spells",
+]
+
+STAGES = [
+    {
+        "name": "extract",
+        "run": run_extraction,
+        "always": True,
+        "online": True,
+        "provides": "ddragon_version",
+    },
+    {
+        "name": "analyze",
+        "run": run_analysis,
+        "tables": ["players", "match_history", "metric_moments"],
+        "config": [
+            "ANOMALY_THRESHOLD",
+            "ANOMALY_DETECTOR",
+            "ANOMALY_WINDOW",
+            "REMAKE_MAX_DURATION",
+        ],
+    },
+    {
+        "name": "export",
+        "run": lambda targets: run_export(datasets=targets),
+        "config": [
+            "EXPORT_FORMATS",
+            "PARQUET_COMPRESSION",
+            "ARROW_COMPRESSION",
+        ],
+        "ddragon": True,
+        "targets": {
+            "player_summary": ["players", "match_history"],
+            "match_history": MATCH_EXPORT_TABLES,
+            "champion_stats": ["players", "champion_stats"],
+            "anomalies": ["players", "match_history"],
+            "player_insights": ["players", "match_history"],
+        },
+        "outputs": lambda target: [
+            f"{OUTPUT_DIR}/{target}.{fmt}" for fmt in EXPORT_FORMATS
+        ],
+    },
+]
+
+
+def load_pipeline_state():
+    if not os.path.exists(PIPELINE_STATE_FILE):
+        return {}
+    with open(PIPELINE_STATE_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_pipeline_state(state):
+    with open(PIPELINE_STATE_FILE, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+
+
+def table_fingerprint(conn, table):
+    columns = [column["name"] for column in inspect(conn).get_columns(table)]
+
+    if table in CONTENT_TABLES:
+        selected = ", ".join(column for column in columns if column != "updated_at")
+        rows = conn.execute(
+            text(f"SELECT {selected} FROM {table} ORDER BY rowid")
+        ).all()
+        return hashlib.sha256(repr(rows).encode("utf-8")).hexdigest()
+
+    aggregates = "COUNT(*), MAX(rowid)"
+    if "updated_at" in columns:
+        aggregates += ", MAX(updated_at)"
+    return list(conn.execute(text(f"SELECT {aggregates} FROM {table}")).one())
+
+
+def stage_fingerprint(conn, stage, tables, ddragon_version):
+    inputs = {
+        "tables": {table: table_fingerprint(conn, table) for table in tables},
+        "config": {name: getattr(config, name) for name in stage.get("config", [])},
+    }
+    if stage.get("ddragon"):
+        inputs["ddragon_version"] = ddragon_version
+
+    raw = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def stage_fingerprints(stage, ddragon_version):
+    targets = stage.get("targets", {None: stage.get("tables", [])})
+    # Looked up at call time, since use_database() replaces the engine
+    with database.engine.connect() as conn:
+        return {
+            target: stage_fingerprint(conn, stage, tables, ddragon_version)
+            for target, tables in targets.items()
+        }
 
 
-def main():
+def stale_targets(stage, state, fingerprints):
+    recorded = state.get("stages", {}).get(stage["name"], {})
+    outputs = stage.get("outputs", lambda target: [])
+
+    stale = []
+    for target, fingerprint in fingerprints.items():
+        missing = [path for path in outputs(target) if not os.path.exists(path)]
+        if missing or recorded.get(str(target)) != fingerprint:
+            stale.append(target)
+    return stale
+
+
+def run_stage(stage, state, force):
+    ddragon_version = state.get("ddragon_version")
+
+    if stage.get("always"):
+        return stage["run"]()
+
+    fingerprints = stage_fingerprints(stage, ddragon_version)
+    targets = list(fingerprints) if force else stale_targets(stage, state, fingerprints)
+    if not targets:
+        print("Inputs unchanged, skipping")
+        METRICS.skip(stage["name"])
+        return None
+
+    if "targets" in stage:
+        print(f"Running for: {', '.join(targets)}")
+        result = stage["run"](targets)
+    else:
+        result = stage["run"]()
+
+    # Recorded after the run, so a stage's own writes don't mark it stale
+    fingerprints = stage_fingerprints(stage, ddragon_version)
+    recorded = state.setdefault("stages", {}).setdefault(stage["name"], {})
+    for target in targets:
+        recorded[str(target)] = fingerprints[target]
+    return result
+
+
+def run_pipeline(offline=False, force=False):
+    init_db()
+    state = load_pipeline_state()
+
+    for number, stage in enumerate(STAGES, start=1):
+        print(f"Step {number}: {stage['name']}")
+        print("-" * 50)
+        with METRICS.stage(stage["name"]) as report:
+            if offline and stage.get("online"):
+                print("Offline, skipping")
+                METRICS.skip(stage["name"])
+            else:
+                with profiled(stage["name"]):
+                    result = run_stage(stage, state, force)
+                if stage.get("provides"):
+                    state[stage["provides"]] = result
+
+            save_pipeline_state(state)
+        print(f"Step {number} finished in {report['seconds']:.3f}s")
+        print()
+
+
+def main(offline=False, force=False):
+    start = time.perf_counter()
+
     print()
     print("=" * 50)
     print("ETL PIPELINE")
     print("=" * 50)
     print()
 
-    print("Step 1: Extract data from Riot API")
-    print("-" * 50)
-    run_extraction()
-    print()
-
-    print("Step 2: Analyze data and detect anomalies")
-    print("-" * 50)
-    run_analysis()
-    print()
-
-    print("Step 3: Export to CSV for Tableau")
-    print("-" * 50)
-    run_export()
-    print()
+    METRICS.reset()
+    run_pipeline(offline, force)
 
     print("=" * 50)
-    print("PIPELINE COMPLETE!")
+    print(f"PIPELINE COMPLETE in {time.perf_counter() - start:.3f}s")
+    print(f"Metrics written to {', '.join(METRICS.write())}")
     print("=" * 50)
     print()
 
 
 if __name__ == "__main__":
-    main()
+    main(offline="--offline" in sys.argv, force="--force" in sys.argv)
@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import functools
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import METRICS_DIR, PROFILE_STAGES, PROFILER
+
+
+PREFIX = "lol_dashboard"
+REPORT_FILE = "run_report.json"
+PROMETHEUS_FILE = f"{PREFIX}.prom"
+
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_labels(key):
+    if not key:
+        return ""
+    pairs = ",".join(f'{name}="{escape_label(value)}"' for name, value in key)
+    return "{" + pairs + "}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = datetime.now()
+            self.counters = {}
+            self.timers = {}
+            self.stages = {}
+            self.current_stage = None
+
+    def count(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            timer = self.timers.setdefault(key, {"count": 0, "sum": 0.0, "max": 0.0})
+            timer["count"] += 1
+            timer["sum"] += seconds
+            timer["max"] = max(timer["max"], seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name, **labels):
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorate
+
+    def rows(self, name, count, **labels):
+        self.count(name, count, **labels)
+        with self.lock:
+            if self.current_stage in self.stages:
+                self.stages[self.current_stage]["rows"] += count
+
+    def skip(self, name):
+        self.count("pipeline_stage_skipped", stage=name)
+        with self.lock:
+            if name in self.stages:
+                self.stages[name]["skipped"] = True
+
+    @contextmanager
+    def stage(self, name):
+        with self.lock:
+            self.stages[name] = {"seconds": 0.0, "rows": 0, "skipped": False}
+            self.current_stage = name
+        start = time.perf_counter()
+        try:
+            yield self.stages[name]
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.stages[name]["seconds"] = elapsed
+                self.current_stage = None
+            self.observe("pipeline_stage", elapsed, stage=name)
+
+    def report(self):
+        finished_at = datetime.now()
+        with self.lock:
+            stages = {
+                name: {
+                    **stage,
+                    "rows_per_second": (
+                        stage["rows"] / stage["seconds"] if stage["seconds"] else 0.0
+                    ),
+                }
+                for name, stage in self.stages.items()
+            }
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            timers = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": timer["count"],
+                    "total_seconds": timer["sum"],
+                    "mean_seconds": timer["sum"] / timer["count"],
+                    "max_seconds": timer["max"],
+                }
+                for (name, labels), timer in sorted(self.timers.items())
+            ]
+
+        return {
+            "started_at": self.started_at.isoformat(),
+            "finished_at": finished_at.isoformat(),
+            "duration_seconds": (finished_at - self.started_at).total_seconds(),
+            "stages": stages,
+            "counters": counters,
+            "timers": timers,
+        }
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timers = sorted(self.timers.items())
+
+        declared = set()
+        for (name, labels), value in counters:
+            metric = f"{PREFIX}_{name}_total"
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} counter")
+                declared.add(metric)
+            lines.append(f"{metric}{prometheus_labels(labels)} {value}")
+
+        for suffix in ("", "_max"):
+            for (name, labels), timer in timers:
+                metric = f"{PREFIX}_{name}_seconds{suffix}"
+                if metric not in declared:
+                    kind = "gauge" if suffix else "summary"
+                    lines.append(f"# TYPE {metric} {kind}")
+                    declared.add(metric)
+                if suffix:
+                    lines.append(f"{metric}{prometheus_labels(labels)} {timer['max']}")
+                else:
+                    lines.append(
+                        f"{metric}_count{prometheus_labels(labels)} {timer['count']}"
+                    )
+                    lines.append(
+                        f"{metric}_sum{prometheus_labels(labels)} {timer['sum']}"
+                    )
+
+        metric = f"{PREFIX}_last_run_timestamp_seconds"
+        lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric} {time.time()}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path=METRICS_DIR):
+        os.makedirs(path, exist_ok=True)
+        outputs = {
+            REPORT_FILE: json.dumps(self.report(), indent=2),
+            PROMETHEUS_FILE: self.prometheus(),
+        }
+
+        written = []
+        for name, content in outputs.items():
+            # Written atomically so a textfile collector never sees a partial file
+            target = os.path.join(path, name)
+            tmp_path = f"{target}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_path, target)
+            written.append(target)
+        return written
+
+
+METRICS = MetricsRegistry()
+
+
+@contextmanager
+def profiled(stage, stages=PROFILE_STAGES, profiler=PROFILER, path=METRICS_DIR):
+    if stage not in stages:
+        yield
+        return
+
+    os.makedirs(path, exist_ok=True)
+    if profiler == "pyinstrument":
+        from pyinstrument import Profiler
+
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            target = os.path.join(path, f"profile-{stage}.html")
+            with open(target, "w", encoding="utf-8") as f:
+                f.write(profile.output_html())
+            print(f"Profile saved to {target}")
+    elif profiler == "cprofile":
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            target = os.path.join(path, f"profile-{stage}.prof")
+            profile.dump_stats(target)
+            pstats.Stats(profile).sort_stats("cumulative").print_stats(15)
+            print(f"Profile saved to {target}")
+    else:
+        raise ValueError(f"Unknown profiler: {profiler}")
@@ -8,6 +8,7 @@ from sqlalchemy import (
     DateTime,
     ForeignKey,
     JSON,
+    Index,
 )
 from sqlalchemy.orm import declarative_base, relationship
 
@@ -32,10 +33,14 @@ class Player(Base):
 
 class MatchHistory(Base):
     __tablename__ = "match_history"
+    __table_args__ = (
+        Index("uq_match_history_player_match", "player_id", "match_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     player_id = Column(Integer, ForeignKey("players.id"))
     match_id = Column(String)
+    ddragon_version = Column(String)
     game_date = Column(DateTime)
     game_duration = Column(Integer)
 
@@ -69,5 +74,196 @@ class MatchHistory(Base):
 
     is_anomaly = Column(Boolean, default=False)
     anomaly_reason = Column(String, nullable=True)
+    scored_threshold = Column(Float, nullable=True)
+    scored_detector = Column(String, nullable=True)
+
+    updated_at = Column(DateTime)
 
     player = relationship("Player", back_populates="matches")
+    item_slots = relationship(
+        "MatchItem", cascade="all, delete-orphan", passive_deletes=True
+    )
+    spell_slots = relationship(
+        "MatchSpell", cascade="all, delete-orphan", passive_deletes=True
+    )
+
+
+class MatchHistoryDeletion(Base):
+    __tablename__ = "match_history_deletions"
+    # Ids must never be reused once old tombstones are pruned
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = Column(Integer, primary_key=True)
+    match_history_id = Column(Integer)
+    player_id = Column(Integer)
+    match_id = Column(String)
+    deleted_at = Column(DateTime)
+
+
+class BackfillCursor(Base):
+    __tablename__ = "backfill_cursors"
+
+    player_id = Column(Integer, ForeignKey("players.id"), primary_key=True)
+    start_time = Column(DateTime)
+    end_time = Column(DateTime)
+    next_start = Column(Integer, default=0)
+    completed = Column(Boolean, default=False)
+    updated_at = Column(DateTime)
+
+
+class ChampionStats(Base):
+    __tablename__ = "champion_stats"
+
+    player_id = Column(Integer, ForeignKey("players.id"), primary_key=True)
+    champion_name = Column(String, primary_key=True)
+    champion_icon_url = Column(String)
+
+    games = Column(Integer, default=0)
+    wins = Column(Integer, default=0)
+    kills = Column(Integer, default=0)
+    deaths = Column(Integer, default=0)
+    assists = Column(Integer, default=0)
+    game_duration = Column(Integer, default=0)
+    gold_earned = Column(Integer, default=0)
+    cs = Column(Integer, default=0)
+    total_damage = Column(Integer, default=0)
+    vision_score = Column(Integer, default=0)
+
+
+class MetricMoments(Base):
+    __tablename__ = "metric_moments"
+
+    player_id = Column(Integer, ForeignKey("players.id"), primary_key=True)
+    metric = Column(String, primary_key=True)
+    count = Column(Integer, default=0)
+    mean = Column(Float, default=0.0)
+    m2 = Column(Float, default=0.0)
+
+
+class Match(Base):
+    __tablename__ = "matches"
+
+    match_id = Column(String, primary_key=True)
+    game_date = Column(DateTime)
+    game_duration = Column(Integer)
+    game_mode = Column(String)
+    queue_id = Column(Integer)
+    map_id = Column(Integer)
+    game_version = Column(String)
+
+
+class MatchTeam(Base):
+    __tablename__ = "match_teams"
+
+    match_id = Column(
+        String, ForeignKey("matches.match_id", ondelete="CASCADE"), primary_key=True
+    )
+    team_id = Column(Integer, primary_key=True)
+    win = Column(Boolean)
+    bans = Column(JSON)
+
+
+class MatchObjective(Base):
+    __tablename__ = "match_objectives"
+
+    match_id = Column(
+        String, ForeignKey("matches.match_id", ondelete="CASCADE"), primary_key=True
+    )
+    team_id = Column(Integer, primary_key=True)
+    objective = Column(String, primary_key=True)
+    first = Column(Boolean)
+    kills = Column(Integer)
+
+
+class MatchParticipant(Base):
+    __tablename__ = "match_participants"
+
+    match_id = Column(
+        String, ForeignKey("matches.match_id", ondelete="CASCADE"), primary_key=True
+    )
+    participant_id = Column(Integer, primary_key=True)
+    puuid = Column(String)
+    riot_id_name = Column(String)
+    riot_id_tagline = Column(String)
+    team_id = Column(Integer)
+    team_position = Column(String)
+
+    champion_id = Column(Integer)
+    champion_name = Column(String)
+    champion_level = Column(Integer)
+
+    win = Column(Boolean)
+
+    kills = Column(Integer)
+    deaths = Column(Integer)
+    assists = Column(Integer)
+    kda = Column(Float)
+    kill_participation = Column(Float)
+
+    gold_earned = Column(Integer)
+    gold_per_min = Column(Float)
+    cs = Column(Integer)
+    cs_per_min = Column(Float)
+
+    total_damage = Column(Integer)
+    damage_per_min = Column(Float)
+    damage_to_objectives = Column(Integer)
+    team_damage_pct = Column(Float)
+
+    vision_score = Column(Integer)
+    wards_placed = Column(Integer)
+    control_wards = Column(Integer)
+
+
+class Item(Base):
+    __tablename__ = "items"
+
+    item_id = Column(Integer, primary_key=True)
+    version = Column(String, primary_key=True)
+    name = Column(String)
+    icon_url = Column(String)
+
+
+class SummonerSpell(Base):
+    __tablename__ = "summoner_spells"
+
+    spell_id = Column(Integer, primary_key=True)
+    version = Column(String, primary_key=True)
+    icon_url = Column(String)
+
+
+class MatchItem(Base):
+    __tablename__ = "match_items"
+
+    match_history_id = Column(
+        Integer, ForeignKey("match_history.id", ondelete="CASCADE"), primary_key=True
+    )
+    slot = Column(Integer, primary_key=True)
+    item_id = Column(Integer)
+
+
+class MatchSpell(Base):
+    __tablename__ = "match_spells"
+
+    match_history_id = Column(
+        Integer, ForeignKey("match_history.id", ondelete="CASCADE"), primary_key=True
+    )
+    slot = Column(Integer, primary_key=True)
+    spell_id = Column(Integer)
+
+
+Index(
+    "ix_match_history_player_date",
+    MatchHistory.player_id,
+    MatchHistory.game_date.desc(),
+)
+Index(
+    "ix_match_history_anomalies",
+    MatchHistory.player_id,
+    MatchHistory.game_date.desc(),
+    sqlite_where=MatchHistory.is_anomaly == True,
+    postgresql_where=MatchHistory.is_anomaly == True,
+)
+Index("ix_match_history_updated_at", MatchHistory.updated_at)
+Index("ix_match_items_item", MatchItem.item_id)
+Index("ix_match_participants_puuid", MatchParticipant.puuid)
@@ -0,0 +1,117 @@
+import bisect
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from riotwatcher.RateLimiter import RateLimiter
+
+from config import RIOT_APP_RATE_LIMITS
+from metrics import METRICS
+
+
+def parse_limits(header):
+    limits = []
+    if not header:
+        return limits
+    for part in header.split(","):
+        count, window = part.strip().split(":")
+        limits.append((int(count), int(window)))
+    return limits
+
+
+class Bucket:
+    def __init__(self, count, window):
+        self.count = count
+        self.window = window
+        self.reserved = deque()
+
+    def next_slot(self, now):
+        while self.reserved and self.reserved[0] <= now - self.window:
+            self.reserved.popleft()
+        if len(self.reserved) < self.count:
+            return now
+        return self.reserved[-self.count] + self.window
+
+    def reserve(self, at):
+        # A delayed request reserves a future slot, so the times are kept
+        # sorted for next_slot's pruning and its count-th-newest lookup
+        bisect.insort(self.reserved, at)
+
+
+class RateLimitScheduler(RateLimiter):
+    def __init__(self, app_limits=RIOT_APP_RATE_LIMITS):
+        self.lock = threading.Lock()
+        self.app_buckets = {}
+        self.method_buckets = {}
+        self.default_app_limits = parse_limits(app_limits)
+        self.blocked_until = {}
+        self.throttled = 0
+
+    def buckets_for(self, region, endpoint_name, method_name):
+        if region not in self.app_buckets:
+            self.app_buckets[region] = [
+                Bucket(count, window) for count, window in self.default_app_limits
+            ]
+        method_key = (region, endpoint_name, method_name)
+        return self.app_buckets[region] + self.method_buckets.get(method_key, [])
+
+    def acquire(self, region, endpoint_name, method_name):
+        with self.lock:
+            now = time.monotonic()
+            start = now
+            for key in [region, (region, endpoint_name, method_name)]:
+                start = max(start, self.blocked_until.get(key, now))
+
+            buckets = self.buckets_for(region, endpoint_name, method_name)
+            for bucket in buckets:
+                start = max(start, bucket.next_slot(now))
+            for bucket in buckets:
+                bucket.reserve(start)
+
+        return start - now
+
+    def wait_until(self, region, endpoint_name, method_name):
+        delay = self.acquire(region, endpoint_name, method_name)
+        if delay <= 0:
+            return None
+        return datetime.now() + timedelta(seconds=delay)
+
+    def update_buckets(self, buckets, limits):
+        current = {(b.count, b.window): b for b in buckets}
+        updated = []
+        for count, window in limits:
+            bucket = current.get((count, window))
+            if bucket is None:
+                bucket = Bucket(count, window)
+                for existing in buckets:
+                    if existing.window == window:
+                        bucket.reserved = existing.reserved
+            updated.append(bucket)
+        return updated
+
+    def record_response(self, region, endpoint_name, method_name, status, headers):
+        method_key = (region, endpoint_name, method_name)
+        METRICS.count(
+            "api_responses", endpoint=f"{endpoint_name}.{method_name}", status=status
+        )
+
+        with self.lock:
+            app_limits = parse_limits(headers.get("X-App-Rate-Limit"))
+            if app_limits:
+                self.app_buckets[region] = self.update_buckets(
+                    self.app_buckets.get(region, []), app_limits
+                )
+
+            method_limits = parse_limits(headers.get("X-Method-Rate-Limit"))
+            if method_limits:
+                self.method_buckets[method_key] = self.update_buckets(
+                    self.method_buckets.get(method_key, []), method_limits
+                )
+
+            if status == 429:
+                self.throttled += 1
+                retry_after = float(headers.get("Retry-After", 1))
+                limit_type = headers.get("X-Rate-Limit-Type", "service")
+                key = region if limit_type == "application" else method_key
+                self.blocked_until[key] = time.monotonic() + retry_after
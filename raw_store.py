@@ -0,0 +1,111 @@
+import os
+import gzip
+import json
+import hashlib
+import threading
+
+from config import RAW_STORE_DIR, RAW_SEGMENT_SIZE
+
+
+INDEX_FILE = "index.tsv"
+
+
+class RawMatchStore:
+    def __init__(self, path=RAW_STORE_DIR, segment_size=RAW_SEGMENT_SIZE):
+        self.path = path
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.index = {}
+
+        os.makedirs(self.path, exist_ok=True)
+        self.load_index()
+
+    def load_index(self):
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+
+        with open(index_path, encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) != 5:
+                    continue
+                match_id, segment, offset, length, digest = parts
+                self.index[match_id] = (segment, int(offset), int(length), digest)
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, segment)
+
+    def current_segment(self):
+        segments = sorted(
+            name for name in os.listdir(self.path) if name.startswith("segment-")
+        )
+        if segments:
+            last = segments[-1]
+            if os.path.getsize(self.segment_path(last)) < self.segment_size:
+                return last
+            number = int(last[len("segment-") : -len(".gz")]) + 1
+        else:
+            number = 1
+        return f"segment-{number:05d}.gz"
+
+    def __contains__(self, match_id):
+        return match_id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def match_ids(self):
+        return list(self.index)
+
+    def put(self, match_id, match):
+        raw = json.dumps(match, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        blob = gzip.compress(raw)
+
+        with self.lock:
+            existing = self.index.get(match_id)
+            if existing and existing[3] == digest:
+                return
+
+            segment = self.current_segment()
+            with open(self.segment_path(segment), "ab") as f:
+                offset = f.tell()
+                f.write(blob)
+
+            with open(os.path.join(self.path, INDEX_FILE), "a", encoding="utf-8") as f:
+                f.write(f"{match_id}\t{segment}\t{offset}\t{len(blob)}\t{digest}\n")
+
+            self.index[match_id] = (segment, offset, len(blob), digest)
+
+    def get(self, match_id):
+        entry = self.index.get(match_id)
+        if not entry:
+            return None
+
+        segment, offset, length, digest = entry
+        with open(self.segment_path(segment), "rb") as f:
+            f.seek(offset)
+            blob = f.read(length)
+        return self.decode(blob, digest)
+
+    def decode(self, blob, digest):
+        raw = gzip.decompress(blob)
+        if hashlib.sha256(raw).hexdigest() != digest:
+            return None
+        return json.loads(raw)
+
+    def iter_matches(self):
+        by_segment = {}
+        for match_id, (segment, offset, length, digest) in self.index.items():
+            by_segment.setdefault(segment, []).append(
+                (offset, length, digest, match_id)
+            )
+
+        for segment in sorted(by_segment):
+            with open(self.segment_path(segment), "rb") as f:
+                for offset, length, digest, match_id in sorted(by_segment[segment]):
+                    f.seek(offset)
+                    match = self.decode(f.read(length), digest)
+                    if match:
+                        yield match_id, match
@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+from requests import Response, Session
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from config import (
+    HTTP_TRANSPORT,
+    HTTP_POOL_CONNECTIONS,
+    HTTP_POOL_MAXSIZE,
+    RECORDINGS_DIR,
+    REPLAY_LATENCY_MS,
+    REPLAY_JITTER_MS,
+    REPLAY_LATENCY_SCALE,
+    REPLAY_RATE_LIMITS,
+    REPLAY_THROTTLE_RATE,
+    REPLAY_ERROR_RATE,
+    REPLAY_SEED,
+)
+from rate_limit import Bucket, parse_limits
+
+
+SKIPPED_HEADERS = {"set-cookie", "content-encoding", "transfer-encoding", "connection"}
+
+
+def request_key(method, url):
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    raw = f"{method} {parts.netloc}{parts.path}?{query}"
+    return parts.netloc, hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def recording_path(path, method, url):
+    host, digest = request_key(method, url)
+    return os.path.join(path, host, f"{digest}.json")
+
+
+def build_response(request, status, headers, body, reason=""):
+    response = Response()
+    response.status_code = status
+    response.reason = reason
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body
+    response.encoding = "utf-8"
+    response.url = request.url
+    response.request = request
+    return response
+
+
+class RecordingAdapter(HTTPAdapter):
+    def __init__(self, path=RECORDINGS_DIR, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.recorded = 0
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        # A 304 has no body and must not replace the recorded 200
+        if response.status_code in (304, 429) or response.status_code >= 500:
+            return response
+
+        path = recording_path(self.path, request.method, request.url)
+        record = {
+            "method": request.method,
+            "url": request.url,
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": {
+                name: value
+                for name, value in response.headers.items()
+                if name.lower() not in SKIPPED_HEADERS
+            },
+            "body": response.content.decode("utf-8", errors="replace"),
+        }
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+        self.recorded += 1
+        return response
+
+    def summary(self):
+        return f"Recorded {self.recorded} responses to {self.path}/"
+
+
+class ReplayAdapter(BaseAdapter):
+    def __init__(
+        self,
+        path=RECORDINGS_DIR,
+        latency_ms=REPLAY_LATENCY_MS,
+        jitter_ms=REPLAY_JITTER_MS,
+        latency_scale=REPLAY_LATENCY_SCALE,
+        rate_limits=REPLAY_RATE_LIMITS,
+        throttle_rate=REPLAY_THROTTLE_RATE,
+        error_rate=REPLAY_ERROR_RATE,
+        seed=REPLAY_SEED,
+    ):
+        super().__init__()
+        self.path = path
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.latency_scale = latency_scale
+        self.rate_limits = rate_limits
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.buckets = {}
+        self.stats = {"served": 0, "missing": 0, "throttled": 0, "errors": 0}
+
+    def delay(self):
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms)
+        seconds = max(self.latency_ms + jitter, 0) / 1000 * self.latency_scale
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def rate_limit(self, host):
+        # Only the Riot API is rate limited; Data Dragon is a plain CDN
+        if not host.endswith("api.riotgames.com"):
+            return {}, None
+
+        limits = parse_limits(self.rate_limits)
+        with self.lock:
+            buckets = self.buckets.setdefault(
+                host, [Bucket(count, window) for count, window in limits]
+            )
+            now = time.monotonic()
+            retry_at = max(bucket.next_slot(now) for bucket in buckets)
+            if retry_at <= now:
+                for bucket in buckets:
+                    bucket.reserve(now)
+            counts = ",".join(
+                f"{len(bucket.reserved)}:{bucket.window}" for bucket in buckets
+            )
+            throttle = self.random.random() < self.throttle_rate
+            error = self.random.random() < self.error_rate
+
+        headers = {
+            "X-App-Rate-Limit": self.rate_limits,
+            "X-App-Rate-Limit-Count": counts,
+        }
+        if retry_at > now:
+            headers.update(
+                {
+                    "Retry-After": f"{retry_at - now:.3f}",
+                    "X-Rate-Limit-Type": "application",
+                }
+            )
+            return headers, 429
+        if throttle:
+            headers.update({"Retry-After": "1", "X-Rate-Limit-Type": "service"})
+            return headers, 429
+        if error:
+            return headers, 503
+        return headers, None
+
+    def send(self, request, **kwargs):
+        self.delay()
+
+        host, _ = request_key(request.method, request.url)
+        headers, failure = self.rate_limit(host)
+        if failure:
+            with self.lock:
+                self.stats["throttled" if failure == 429 else "errors"] += 1
+            return build_response(request, failure, headers, b"{}")
+
+        path = recording_path(self.path, request.method, request.url)
+        if not os.path.exists(path):
+            with self.lock:
+                self.stats["missing"] += 1
+            body = json.dumps({"status": {"status_code": 404, "message": "Not found"}})
+            return build_response(request, 404, headers, body.encode("utf-8"))
+
+        with open(path, encoding="utf-8") as f:
+            record = json.load(f)
+        with self.lock:
+            self.stats["served"] += 1
+
+        etag = CaseInsensitiveDict(record["headers"]).get("ETag")
+        if etag and request.headers.get("If-None-Match") == etag:
+            return build_response(request, 304, {"ETag": etag, **headers}, b"")
+        return build_response(
+            request,
+            record["status"],
+            {**record["headers"], **headers},
+            record["body"].encode("utf-8"),
+            record.get("reason", ""),
+        )
+
+    def close(self):
+        pass
+
+    def summary(self):
+        return (
+            f"Replayed {self.stats['served']} responses "
+            f"({self.stats['missing']} missing, {self.stats['throttled']} throttled, "
+            f"{self.stats['errors']} errors)"
+        )
+
+
+TRANSPORTS = {
+    "live": HTTPAdapter,
+    "record": RecordingAdapter,
+    "replay": ReplayAdapter,
+}
+
+
+def create_session(mode=HTTP_TRANSPORT):
+    if mode not in TRANSPORTS:
+        raise ValueError(f"Unknown HTTP transport: {mode}")
+
+    adapter_class = TRANSPORTS[mode]
+    if issubclass(adapter_class, HTTPAdapter):
+        # Sized for every fetch worker to keep its own connection alive
+        adapter = adapter_class(
+            pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE
+        )
+    else:
+        adapter = adapter_class()
+
+    session = Session()
+    session.headers.update({"Accept-Encoding": "gzip", "Connection": "keep-alive"})
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session, adapter